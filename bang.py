@@ -23,22 +23,74 @@ true, arguments are passed without being URL-encoded.
 By default this scripts attempts to load your config file from
 `~/.config/bangs.json`, but you can specify the BANGS_CONFIG_PATH
 environment variable or pass the path through the -c command-line option.
+
+The parsed config and its bangs indexed by handle are cached in
+`~/.cache/bangs.pickle`, and the JSON file is parsed again only when its
+modification time changes.
+
+When there are several queries (e.g. with -f), all URLs are given to the
+browser in a single command. This works with browsers known to the webbrowser
+module that accept several URLs; to choose the command, the config can have a
+"browser" key with a list of arguments to which URLs are appended, e.g.
+["firefox", "--new-tab"].
+
+To avoid paying for the interpreter startup, imports and config loading on
+every hotkey press, run `bang.py --daemon` once in your session: it listens on
+a Unix socket, `$XDG_RUNTIME_DIR/bangs.sock` by default or the
+BANGS_SOCKET_PATH environment variable. Without XDG_RUNTIME_DIR, the socket is
+put in `/tmp/bangs-<uid>`, which is only used if it is a directory owned by the
+user and not writable by others. Later calls to this script only send
+their arguments to the daemon, which runs Rofi and opens URLs itself. The
+daemon measures the delay between the last user input (the command or the last
+Rofi prompt) and the browser launch; use --daemon-stats to see it. Any program
+can act as a client: it sends the current directory and the arguments
+separated by NUL bytes, closes its write side, and reads back the exit status
+on a line followed by the output.
+
+Opened bangs are recorded with their query and time in a history file,
+`~/.local/share/bangs/history.tsv` or BANGS_HISTORY_PATH, unless the config has
+a "history" key set to false. The history is used to rank handles in Rofi by
+frecency (frequency weighted by how recent uses are), and to offer previous
+queries of a handle when asking for one; use --suggest to get them from the
+command line. Only the last few thousand entries are kept.
 """
 
-import argparse
-import json
+import bisect
 import os
-import subprocess
-import urllib.parse
-import webbrowser
+import socket
+import sys
+import time
+
+# Other modules are imported in the functions using them, so that commands
+# forwarded to the daemon do not import them.
+
+# Openers that only take a single URL per call.
+SINGLE_URL_OPENERS = ("xdg-open", "gio", "gvfs-open", "gnome-open", "kfmclient",
+                      "exo-open")
+
+# Latencies of the running daemon, if any.
+LATENCIES = None
+
+# Number of history entries to keep; the file is compacted at twice that.
+HISTORY_SIZE = 5000
+# Weight of a history entry by maximum age in days, like Firefox does.
+FRECENCY_WEIGHTS = ((4, 100), (14, 70), (31, 50), (90, 30), (float("inf"), 10))
+# Number of previous queries kept per trie node.
+SUGGESTIONS = 50
+
+
+def get_config_path():
+    return (
+        os.environ.get("BANGS_CONFIG_PATH")
+        or os.path.expanduser("~/.config/bangs.json")
+    )
 
 
 def load_config(config_path=None):
+    import json
+
     if config_path is None:
-        config_path = (
-            os.environ.get("BANGS_CONFIG_PATH")
-            or os.path.expanduser("~/.config/bangs.json")
-        )
+        config_path = get_config_path()
     try:
         with open(config_path, "rt") as bangs_file:
             return json.load(bangs_file)
@@ -46,6 +98,49 @@ def load_config(config_path=None):
         return None
 
 
+def load_compiled_config(config_path=None):
+    """Return the config and its bangs by handle, or (None, None) on error.
+
+    Both are loaded from the cache file if it was made from the same config
+    file with the same modification time, else the cache is refreshed.
+    """
+    import pickle
+
+    if config_path is None:
+        config_path = get_config_path()
+    config_path = os.path.abspath(config_path)
+    try:
+        mtime = os.stat(config_path).st_mtime_ns
+    except OSError:
+        return None, None
+    cache_path = os.path.join(
+        os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+        "bangs.pickle",
+    )
+    try:
+        with open(cache_path, "rb") as cache_file:
+            cache = pickle.load(cache_file)
+        if cache["path"] == config_path and cache["mtime"] == mtime:
+            return cache["config"], cache["index"]
+    except (OSError, EOFError, pickle.UnpicklingError, KeyError, TypeError):
+        pass
+
+    config = load_config(config_path)
+    if config is None:
+        return None, None
+    index = {bang["handle"]: bang for bang in config["bangs"]}
+    cache = {"path": config_path, "mtime": mtime, "config": config, "index": index}
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}"
+        with open(tmp_path, "wb") as cache_file:
+            pickle.dump(cache, cache_file)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return config, index
+
+
 def list_bangs(config):
     for item in config["bangs"]:
         name = item["name"]
@@ -54,6 +149,8 @@ def list_bangs(config):
 
 
 def run_rofi(config, input_text="", title="bang"):
+    import subprocess
+
     rofi_path = config.get("rofi_path", "rofi")
     completed_process = subprocess.run(
         [rofi_path, "-dmenu", "-p", title],
@@ -61,34 +158,378 @@ def run_rofi(config, input_text="", title="bang"):
         capture_output=True,
         input=input_text,
     )
+    if LATENCIES:
+        LATENCIES.mark()
     output = completed_process.stdout
     if not output:
         exit("Empty Rofi output.")
     return output
 
 
-def open_bang(config, handle, query):
-    try:
-        bang = next(bang for bang in config["bangs"] if handle == bang["handle"])
-    except StopIteration:
-        print("Unknown handle.")
-        return
+def get_bang_url(bang, query):
+    import urllib.parse
+
     query = query.strip()
     if not bang.get("raw", False):
         query = urllib.parse.quote(query)
-    url = bang["url"].format(query)
-    webbrowser.open_new_tab(url)
+    return bang["url"].format(query)
+
+
+def open_bang(config, index, handle, queries, history=None):
+    """Open the URLs of this bang for all queries at once."""
+    try:
+        bang = index[handle]
+    except KeyError:
+        print("Unknown handle.")
+        return
+    open_urls(config, [get_bang_url(bang, query) for query in queries])
+    if history is not None:
+        history.add(handle, queries)
+
+
+def get_browser_command(config):
+    """Return a command to which URLs can be appended, or None."""
+    import webbrowser
+
+    if command := config.get("browser"):
+        return list(command)
+    try:
+        browser = webbrowser.get()
+    except webbrowser.Error:
+        return None
+    name = getattr(browser, "name", None)
+    if not name or os.path.basename(name) in SINGLE_URL_OPENERS:
+        return None
+    if isinstance(browser, webbrowser.GenericBrowser):
+        return [name] + [arg for arg in browser.args if "%s" not in arg]
+    if isinstance(browser, webbrowser.UnixBrowser):
+        return [name]
+    return None
+
+
+def open_urls(config, urls):
+    """Open URLs in new tabs, with a single browser command if possible."""
+    import subprocess
+    import webbrowser
+
+    if len(urls) > 1 and (command := get_browser_command(config)):
+        try:
+            subprocess.Popen(
+                command + urls,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True,
+            )
+            urls = []
+        except OSError:
+            pass
+    for url in urls:
+        webbrowser.open_new_tab(url)
+    if LATENCIES:
+        LATENCIES.record()
+
+
+class QueryTrie:
+    """Prefix tree of queries, each node holding its best completions.
+
+    Queries are inserted from the best to the worst score, so the list of
+    completions of each node is already sorted and can be capped; looking up
+    a prefix is then only a walk down as many nodes as it has characters.
+    """
+
+    def __init__(self, scores, limit=SUGGESTIONS):
+        self.root = ({}, [])
+        for query in sorted(scores, key=scores.get, reverse=True):
+            node = self.root
+            for char in query:
+                if len(node[1]) < limit:
+                    node[1].append(query)
+                node = node[0].setdefault(char, ({}, []))
+            if len(node[1]) < limit:
+                node[1].append(query)
+
+    def complete(self, prefix):
+        node = self.root
+        for char in prefix:
+            node = node[0].get(char)
+            if node is None:
+                return []
+        return node[1]
+
+
+class History:
+    """Bounded log of opened bangs, with frecency ranking and completion."""
 
+    def __init__(self, path=None):
+        self.path = path or os.environ.get("BANGS_HISTORY_PATH") or \
+            os.path.expanduser("~/.local/share/bangs/history.tsv")
+        self.mtime = None
+        self.entries = []
+        self.tries = {}
+        self.refresh()
+
+    def refresh(self):
+        """Reload the history file if it was modified by someone else."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        self.entries = []
+        self.tries = {}
+        try:
+            with open(self.path, "rt") as history_file:
+                for line in history_file:
+                    timestamp, handle, query = line.rstrip("\n").split("\t", 2)
+                    self.entries.append((float(timestamp), handle, query))
+        except (OSError, ValueError):
+            pass
+        if len(self.entries) > 2 * HISTORY_SIZE:
+            self.entries = self.entries[-HISTORY_SIZE:]
+            self.write(self.entries, "wt")
+        else:
+            self.mtime = mtime
+
+    def write(self, entries, mode):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, mode) as history_file:
+                history_file.writelines(
+                    f"{timestamp:.0f}\t{handle}\t{query}\n"
+                    for timestamp, handle, query in entries
+                )
+            self.mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            pass
+
+    def add(self, handle, queries):
+        now = time.time()
+        new_entries = [
+            (now, handle, " ".join(query.split())) for query in queries
+        ]
+        self.entries += new_entries
+        self.tries.pop(handle, None)
+        if len(self.entries) > 2 * HISTORY_SIZE:
+            self.entries = self.entries[-HISTORY_SIZE:]
+            self.write(self.entries, "wt")
+        else:
+            self.write(new_entries, "at")
+
+    def frecency(self, key):
+        """Return frecency scores of entries grouped by the key function."""
+        now = time.time()
+        scores = {}
+        for entry in self.entries:
+            age_days = (now - entry[0]) / 86400
+            weight = next(w for days, w in FRECENCY_WEIGHTS if age_days < days)
+            entry_key = key(entry)
+            scores[entry_key] = scores.get(entry_key, 0) + weight
+        return scores
+
+    def rank_handles(self, handles):
+        """Sort handles by frecency, keeping the given order for ties."""
+        scores = self.frecency(lambda entry: entry[1])
+        return sorted(handles, key=lambda handle: -scores.get(handle, 0))
+
+    def suggest(self, handle, prefix=""):
+        """Return previous queries of this handle starting with prefix."""
+        if (trie := self.tries.get(handle)) is None:
+            scores = self.frecency(
+                lambda entry: entry[2] if entry[1] == handle else None
+            )
+            scores.pop(None, None)
+            scores.pop("", None)
+            trie = self.tries[handle] = QueryTrie(scores)
+        return trie.complete(prefix)
+
+
+def get_socket_path():
+    return os.environ.get("BANGS_SOCKET_PATH") or os.path.join(
+        os.environ.get("XDG_RUNTIME_DIR") or f"/tmp/bangs-{os.getuid()}",
+        "bangs.sock",
+    )
+
+
+def is_socket_dir_safe(socket_path):
+    """Return True unless the default socket directory may be someone else's.
+
+    It must be a real directory owned by the user and writable only by them.
+    A path from BANGS_SOCKET_PATH is trusted.
+    """
+    if os.environ.get("BANGS_SOCKET_PATH"):
+        return True
+    import stat
+
+    try:
+        dir_stat = os.lstat(os.path.dirname(socket_path))
+    except OSError:
+        return False
+    return (stat.S_ISDIR(dir_stat.st_mode)
+            and dir_stat.st_uid == os.getuid()
+            and not dir_stat.st_mode & 0o022)
+
+
+def forward_to_daemon(argv):
+    """Run this command in the daemon; return its exit status, or None."""
+    if not is_socket_dir_safe(get_socket_path()):
+        return None
+    try:
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.connect(get_socket_path())
+            sock.sendall("\0".join([os.getcwd(), *argv]).encode())
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while chunk := sock.recv(65536):
+                chunks.append(chunk)
+    except OSError:
+        return None
+    status, _, output = b"".join(chunks).decode().partition("\n")
+    (sys.stdout if status == "0" else sys.stderr).write(output)
+    return int(status or 1)
+
+
+class Latencies:
+    """Histogram of delays between user input and browser launch."""
+
+    BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS_MS) + 1)
+        self.start = time.perf_counter()
+
+    def mark(self):
+        self.start = time.perf_counter()
+
+    def record(self):
+        delay_ms = (time.perf_counter() - self.start) * 1000
+        self.counts[bisect.bisect_left(self.BOUNDS_MS, delay_ms)] += 1
+
+    def format(self):
+        lines = [
+            f"<= {bound} ms: {count}"
+            for bound, count in zip(self.BOUNDS_MS, self.counts)
+        ]
+        lines.append(f"> {self.BOUNDS_MS[-1]} ms: {self.counts[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+class WarmConfig:
+    """Keep compiled configs in memory, reloading them when they change."""
+
+    def __init__(self):
+        self.configs = {}
+
+    def __call__(self, config_path=None):
+        config_path = os.path.abspath(config_path or get_config_path())
+        try:
+            mtime = os.stat(config_path).st_mtime_ns
+        except OSError:
+            return None, None
+        cached = self.configs.get(config_path)
+        if cached is None or cached[0] != mtime:
+            cached = self.configs[config_path] = (
+                mtime, load_compiled_config(config_path)
+            )
+        return cached[1]
+
+
+def run_daemon():
+    """Serve commands sent by forward_to_daemon, one at a time."""
+    import contextlib
+    import io
+    import signal
+    import socketserver
+    import threading
+
+    global LATENCIES  # pylint: disable=global-statement
+    LATENCIES = Latencies()
+    load_warm_config = WarmConfig()
+    history = History()
+    lock = threading.Lock()
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            LATENCIES.mark()
+            request = self.rfile.read()
+            if not request:
+                return
+            cwd, *argv = request.decode().split("\0")
+            if argv == ["--daemon-stats"]:
+                self.wfile.write(("0\n" + LATENCIES.format()).encode())
+                return
+            output = io.StringIO()
+            status = 0
+            with lock, contextlib.redirect_stdout(output), \
+                    contextlib.redirect_stderr(output):
+                try:
+                    history.refresh()
+                    main(argv, cwd=cwd, config_loader=load_warm_config,
+                         history=history)
+                except SystemExit as exc:
+                    if isinstance(exc.code, str):
+                        print(exc.code)
+                        status = 1
+                    else:
+                        status = exc.code or 0
+            # The client may be gone, e.g. after a long Rofi prompt.
+            with contextlib.suppress(BrokenPipeError):
+                self.wfile.write(f"{status}\n{output.getvalue()}".encode())
+
+    socket_path = get_socket_path()
+    os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+    if not is_socket_dir_safe(socket_path):
+        exit(f"{os.path.dirname(socket_path)} must be a directory owned by "
+             f"you and not writable by others.")
+    with socket.socket(socket.AF_UNIX) as sock:
+        with contextlib.suppress(OSError):
+            sock.connect(socket_path)
+            exit("A daemon is already running.")
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(socket_path)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit())
+    with socketserver.ThreadingUnixStreamServer(socket_path, Handler) as server:
+        os.chmod(socket_path, 0o600)
+        print(f"Listening on {socket_path}.")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.unlink(socket_path)
+
+
+def main(argv=None, cwd=None, config_loader=load_compiled_config,
+         history=None):
+    import argparse
 
-def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("-c", "--config", help="path to JSON config file")
     ap.add_argument("-l", "--list", action="store_true", help="show available bangs")
     ap.add_argument("-b", "--bang", nargs="+", help="launch with this bang already set")
     ap.add_argument("-f", "--queries-file", help="file with one bang argument per line")
-    args = ap.parse_args()
+    ap.add_argument("-S", "--suggest", nargs="+", metavar=("HANDLE", "PREFIX"),
+                    help="show previous queries for a handle")
+    ap.add_argument("--daemon", action="store_true", help="run as a daemon")
+    ap.add_argument("--daemon-stats", action="store_true",
+                    help="show latencies of the running daemon")
+    ap.add_argument("-N", "--no-daemon", action="store_true",
+                    help="do not use the running daemon")
+    args = ap.parse_args(argv)
 
-    config = load_config()
+    if args.daemon:
+        run_daemon()
+        return
+    if args.daemon_stats:
+        exit("No daemon running.")
+    # Paths sent to the daemon are relative to the client directory.
+    if cwd is not None:
+        if args.config:
+            args.config = os.path.join(cwd, args.config)
+        if args.queries_file:
+            args.queries_file = os.path.join(cwd, args.queries_file)
+
+    config, index = config_loader(args.config)
     if config is None:
         exit("Can't load config file.")
 
@@ -96,6 +537,18 @@ def main():
         list_bangs(config)
         return
 
+    if not config.get("history", True):
+        history = None
+    elif history is None:
+        history = History()
+
+    if args.suggest:
+        if history is not None:
+            prefix = " ".join(args.suggest[1:])
+            for query in history.suggest(args.suggest[0], prefix):
+                print(query)
+        return
+
     queries = []
     if listfile := args.queries_file:
         try:
@@ -111,7 +564,10 @@ def main():
             queries.append(" ".join(bang_args[1:]))
     # Else show a Rofi with the list of available bangs.
     else:
-        process_input = "\n".join(i["handle"] for i in config["bangs"]) + "\n"
+        handles = [i["handle"] for i in config["bangs"]]
+        if history is not None:
+            handles = history.rank_handles(handles)
+        process_input = "\n".join(handles) + "\n"
         output = run_rofi(config, input_text=process_input)
         parts = output.split(maxsplit=1)
         if len(parts) < 1:
@@ -122,11 +578,18 @@ def main():
 
     # If no queries were obtained during options parsing, show Rofi now to get a single query.
     if not queries:
-        queries.append(run_rofi(config, title=handle))
+        previous = history.suggest(handle) if history is not None else []
+        process_input = "".join(query + "\n" for query in previous)
+        queries.append(run_rofi(config, input_text=process_input, title=handle))
 
-    for query in queries:
-        open_bang(config, handle, query)
+    open_bang(config, index, handle, queries, history=history)
 
 
 if __name__ == "__main__":
-    main()
+    status = None
+    if not {"--daemon", "-N", "--no-daemon"} & set(sys.argv[1:]):
+        status = forward_to_daemon(sys.argv[1:])
+    if status is None:
+        main()
+    else:
+        sys.exit(status)
@@ -1,14 +1,48 @@
 #!/usr/bin/env python3
-"""Control Clementine from the command line using dbus."""
+"""Control Clementine, or other MPRIS players, from the command line using dbus.
+
+Commands go to the player given with --player if any, else to the most
+recently active player: the last one seen starting to play by a "watch"
+command or chosen by a previous command, remembered in a file in
+$XDG_RUNTIME_DIR. If it is playing, which costs a single Get call, it is used.
+Otherwise players are discovered with ListNames and the first playing one is
+used, then the remembered one if it is still there, Clementine being preferred
+otherwise.
+
+The "info" command gets all player properties with a single GetAll call and
+prints them on one line, which is better for status bars than calling the
+script for each property. See the help of its --format option for the
+available fields.
+
+The "watch" command stays running and prints the same line each time it
+changes. It listens to the PropertiesChanged and Seeked signals of the player
+and computes the position from the playback rate instead of polling, so it
+only wakes up on events and, while playing, when the displayed position
+changes. It requires PyGObject for the GLib main loop. The --bus option allows
+to use another bus than the session bus, e.g. a private bus for tests.
+
+The "batch" command runs several commands in one go, e.g. "batch next info
+position". If dbus-next is installed, it uses it with asyncio to send all calls
+on one connection without waiting for each reply, so they cost about one round
+trip instead of one each; the player still handles them in order. Otherwise it
+falls back to serial dbus-python calls. "batch --benchmark N" compares both
+against a fake player started with the "mock-player" command.
+"""
 
 import argparse
+import asyncio
+import os
 import sys
+import time
 
 import dbus  # type: ignore
 
 CLEM_NAME = "org.mpris.MediaPlayer2.clementine"
 CLEM_PATH = "/org/mpris/MediaPlayer2"
 CLEM_PLAYER_NAME = "org.mpris.MediaPlayer2.Player"
+MPRIS_PREFIX = "org.mpris.MediaPlayer2."
+DBUS_NAME = "org.freedesktop.DBus"
+DBUS_PATH = "/org/freedesktop/DBus"
 
 # org.mpris.MediaPlayer2.Player.CanControl
 # org.mpris.MediaPlayer2.Player.CanGoNext
@@ -35,11 +69,35 @@ CLEM_PLAYER_NAME = "org.mpris.MediaPlayer2.Player"
 # org.mpris.MediaPlayer2.Player.Stop
 # org.mpris.MediaPlayer2.Player.Volume
 
+DEFAULT_INFO_FORMAT = "{status} {position}/{length} {artist} - {title}"
+
+BATCH_METHODS = {
+    "play": "Play",
+    "play-pause": "PlayPause",
+    "pause": "Pause",
+    "stop": "Stop",
+    "previous": "Previous",
+    "next": "Next",
+}
+BATCH_PROPERTIES = {
+    "status": "PlaybackStatus",
+    "position": "Position",
+    "volume": "Volume",
+}
+BATCH_COMMANDS = [*BATCH_METHODS, *BATCH_PROPERTIES, "info"]
+BENCHMARK_COMMANDS = ["next", "info", "position"]
+MOCK_NAME = MPRIS_PREFIX + "clemctl_mock"
+
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("-q", "--quiet", action="store_true",
                         help="do not print errors")
+    parser.add_argument("--bus", help="D-Bus address to use instead of the "
+                                      "session bus")
+    parser.add_argument("-p", "--player",
+                        help="player to control, e.g. clementine or vlc "
+                             "(default the last player seen playing)")
 
     action_group = parser.add_mutually_exclusive_group()
     action_group.add_argument("--play", action="store_true")
@@ -56,6 +114,33 @@ def main():
     pos_parser.set_defaults(func=handle_position_command)
     status_parser = subparsers.add_parser("status", help="get playback status")
     status_parser.set_defaults(func=handle_status_command)
+    info_parser = subparsers.add_parser("info", help="get player info at once")
+    info_parser.add_argument(
+        "-f", "--format", default=DEFAULT_INFO_FORMAT,
+        help="Python format string with fields status, position, length, "
+             "artist, title, album, url, volume, loop and shuffle; default: "
+             + DEFAULT_INFO_FORMAT
+    )
+    info_parser.set_defaults(func=handle_info_command)
+    watch_parser = subparsers.add_parser("watch",
+                                         help="print player info on changes")
+    watch_parser.add_argument("-f", "--format", default=DEFAULT_INFO_FORMAT,
+                              help="same as for the info command")
+    watch_parser.set_defaults(func=handle_watch_command)
+    batch_parser = subparsers.add_parser("batch",
+                                         help="run several commands at once")
+    batch_parser.add_argument("commands", nargs="*", metavar="COMMAND",
+                              help="one of: " + ", ".join(BATCH_COMMANDS))
+    batch_parser.add_argument("-f", "--format", default=DEFAULT_INFO_FORMAT,
+                              help="same as for the info command")
+    batch_parser.add_argument("--benchmark", type=int, metavar="N",
+                              help="time N runs of the commands (default: "
+                                   + " ".join(BENCHMARK_COMMANDS) + ") "
+                                   "against a mock player")
+    batch_parser.set_defaults(func=handle_batch_command)
+    mock_parser = subparsers.add_parser("mock-player",
+                                        help="run a fake player for tests")
+    mock_parser.set_defaults(func=handle_mock_player_command)
 
     args = parser.parse_args()
 
@@ -63,11 +148,11 @@ def main():
         if hasattr(args, "func"):
             args.func(args)
             return
-        bus = dbus.SessionBus()
-        clem_object = get_clementine_object(bus)
+        bus = get_bus(args)
+        clem_object = get_clementine_object(bus, get_player_name(bus, args))
     except dbus.exceptions.DBusException:
         if not args.quiet:
-            sys.stderr.write("Can't get Clementine object.\n")
+            sys.stderr.write("Can't get player object.\n")
         sys.exit(1)
 
     if args.play:
@@ -86,28 +171,187 @@ def main():
         parser.print_usage()
 
 
-def get_clementine_object(bus):
-    clem_object = bus.get_object(CLEM_NAME, CLEM_PATH)
+def get_bus(args, mainloop=None):
+    if args.bus:
+        return dbus.bus.BusConnection(args.bus, mainloop=mainloop)
+    return dbus.SessionBus(mainloop=mainloop)
+
+
+def get_clementine_object(bus, name=CLEM_NAME):
+    clem_object = bus.get_object(name, CLEM_PATH)
     return clem_object
 
 
+def get_player_name(bus, args):
+    """Return the bus name of the player commands should go to."""
+    if args.player:
+        return get_full_player_name(args.player)
+    active_name = load_active_player()
+    if active_name and get_playback_status(bus, active_name) == "Playing":
+        return active_name
+    name = PlayerCache(bus).pick(prefer_active=False)
+    if name is None:
+        return CLEM_NAME
+    save_active_player(name)
+    return name
+
+
+def get_playback_status(bus, name):
+    """Return the PlaybackStatus of this player, or None if it is not there."""
+    try:
+        return bus.get_object(name, CLEM_PATH).Get(
+            CLEM_PLAYER_NAME, "PlaybackStatus",
+            dbus_interface=dbus.PROPERTIES_IFACE,
+        )
+    except dbus.exceptions.DBusException:
+        return None
+
+
+def get_full_player_name(name):
+    return name if name.startswith(MPRIS_PREFIX) else MPRIS_PREFIX + name
+
+
+def get_bus_interface(bus):
+    return dbus.Interface(bus.get_object(DBUS_NAME, DBUS_PATH),
+                          dbus_interface=DBUS_NAME)
+
+
+def get_active_player_path():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(runtime_dir, f"clemctl-{os.getuid()}-player")
+
+
+def open_active_player_file(flags):
+    """Open the active player file, refusing symlinks and others' files."""
+    fd = os.open(get_active_player_path(), flags | os.O_NOFOLLOW, 0o600)
+    if os.fstat(fd).st_uid != os.getuid():
+        os.close(fd)
+        raise PermissionError("active player file owned by another user")
+    return fd
+
+
+def load_active_player():
+    try:
+        with open(open_active_player_file(os.O_RDONLY), "rt") as active_file:
+            return active_file.read().strip()
+    except OSError:
+        return None
+
+
+def save_active_player(name):
+    try:
+        fd = open_active_player_file(os.O_WRONLY | os.O_CREAT)
+        with open(fd, "wt") as active_file:
+            active_file.truncate()
+            active_file.write(name)
+    except OSError:
+        pass
+
+
+class PlayerCache:
+    """MPRIS players of a bus and the one most recently active.
+
+    Players are listed once; if listen() is called, NameOwnerChanged and
+    PropertiesChanged signals keep the list and the active player up to date
+    while a main loop runs, and on_active_changed is called with the name of
+    each new active player, or None when the last one quits.
+    """
+
+    def __init__(self, bus, on_active_changed=None):
+        self.bus = bus
+        self.bus_interface = get_bus_interface(bus)
+        self.on_active_changed = on_active_changed
+        self.owners = {
+            str(name): None
+            for name in self.bus_interface.ListNames()
+            if name.startswith(MPRIS_PREFIX)
+        }
+        self.active = None
+
+    def listen(self):
+        for name in self.owners:
+            try:
+                self.owners[name] = str(self.bus_interface.GetNameOwner(name))
+            except dbus.exceptions.DBusException:
+                pass
+        self.bus.add_signal_receiver(
+            self.on_name_owner_changed, "NameOwnerChanged",
+            dbus_interface=DBUS_NAME, bus_name=DBUS_NAME, path=DBUS_PATH,
+        )
+        self.bus.add_signal_receiver(
+            self.on_properties_changed, "PropertiesChanged",
+            dbus_interface=dbus.PROPERTIES_IFACE, path=CLEM_PATH,
+            sender_keyword="sender",
+        )
+        self.set_active(self.pick())
+
+    def pick(self, prefer_active=True):
+        """Return the player to use, or None if there is no player.
+
+        It is the last active player if it is still there, else the first
+        playing player, else Clementine or the first player found. If
+        prefer_active is False, a playing player comes before the last active
+        one.
+        """
+        if self.active in self.owners:
+            return self.active
+        active_name = load_active_player()
+        if prefer_active and active_name in self.owners:
+            return active_name
+        for name in sorted(self.owners):
+            if get_playback_status(self.bus, name) == "Playing":
+                return name
+        if active_name in self.owners:
+            return active_name
+        if CLEM_NAME in self.owners:
+            return CLEM_NAME
+        return min(self.owners, default=None)
+
+    def set_active(self, name):
+        if name == self.active:
+            return
+        self.active = name
+        if name is not None:
+            save_active_player(name)
+        if self.on_active_changed:
+            self.on_active_changed(name)
+
+    def on_name_owner_changed(self, name, _old_owner, new_owner):
+        if not name.startswith(MPRIS_PREFIX):
+            return
+        if new_owner:
+            self.owners[str(name)] = str(new_owner)
+            if self.active is None:
+                self.set_active(str(name))
+        else:
+            self.owners.pop(name, None)
+            if name == self.active:
+                self.set_active(self.pick())
+
+    def on_properties_changed(self, interface, changed, _invalidated,
+                              sender=None):
+        if interface != CLEM_PLAYER_NAME:
+            return
+        if changed.get("PlaybackStatus") == "Playing":
+            for name, owner in self.owners.items():
+                if owner == sender:
+                    self.set_active(name)
+                    break
+
+
 def get_player_interface(clem_object):
     interface = dbus.Interface(clem_object, dbus_interface=CLEM_PLAYER_NAME)
     return interface
 
 
-def handle_position_command(_args):
-    bus = dbus.SessionBus()
-    hour, minutes, seconds = get_position(bus)
-    timestamp = f"{minutes:02}:{seconds:02}"
-    if hour:
-        timestamp = f"{hour}:{timestamp}"
-    print(timestamp)
+def handle_position_command(args):
+    bus = get_bus(args)
+    clem_object = get_clementine_object(bus, get_player_name(bus, args))
+    print(format_position(clem_object.Get(CLEM_PLAYER_NAME, "Position")))
 
 
-def get_position(bus):
-    clem_object = get_clementine_object(bus)
-    position = clem_object.Get(CLEM_PLAYER_NAME, "Position")
+def split_position(position):
+    """Split a position in microseconds into hours, minutes and seconds."""
     timestamp_ns = int(position)
     timestamp_sec = timestamp_ns // 1_000_000
     timestamp_h = timestamp_sec // 3600
@@ -116,12 +360,528 @@ def get_position(bus):
     return (timestamp_h, timestamp_min, timestamp_sec)
 
 
-def handle_status_command(_args):
-    bus = dbus.SessionBus()
-    clem_object = get_clementine_object(bus)
+def format_position(position):
+    hour, minutes, seconds = split_position(position)
+    timestamp = f"{minutes:02}:{seconds:02}"
+    if hour:
+        timestamp = f"{hour}:{timestamp}"
+    return timestamp
+
+
+def handle_status_command(args):
+    bus = get_bus(args)
+    clem_object = get_clementine_object(bus, get_player_name(bus, args))
     status = clem_object.Get(CLEM_PLAYER_NAME, "PlaybackStatus")
     print(status)
 
 
+def handle_info_command(args):
+    check_info_format(args.format)
+    bus = get_bus(args)
+    clem_object = get_clementine_object(bus, get_player_name(bus, args))
+    properties = get_player_properties(clem_object)
+    print(format_info(properties, args.format))
+
+
+def get_player_properties(clem_object):
+    """Return all player properties, in a single round trip."""
+    return clem_object.GetAll(CLEM_PLAYER_NAME,
+                              dbus_interface=dbus.PROPERTIES_IFACE)
+
+
+def format_info(properties, info_format=DEFAULT_INFO_FORMAT):
+    """Format player properties, as returned by GetAll, with info_format."""
+    metadata = properties.get("Metadata", {})
+    return info_format.format(
+        status=properties.get("PlaybackStatus", ""),
+        position=format_position(properties.get("Position", 0)),
+        length=format_position(metadata.get("mpris:length", 0)),
+        artist=" & ".join(metadata.get("xesam:artist", [])),
+        title=metadata.get("xesam:title", ""),
+        album=metadata.get("xesam:album", ""),
+        url=metadata.get("xesam:url", ""),
+        volume=round(float(properties.get("Volume", 0)) * 100),
+        loop=properties.get("LoopStatus", ""),
+        shuffle=bool(properties.get("Shuffle", False)),
+    )
+
+
+def check_info_format(info_format):
+    """Exit if info_format can't be used by format_info."""
+    try:
+        format_info({}, info_format)
+    except KeyError as exc:
+        exit(f"Unknown field {exc}.")
+    except (IndexError, ValueError) as exc:
+        exit(f"Invalid format: {exc}.")
+
+
+def handle_watch_command(args):
+    from dbus.mainloop.glib import DBusGMainLoop  # type: ignore
+    from gi.repository import GLib  # type: ignore
+
+    check_info_format(args.format)
+    bus = get_bus(args, mainloop=DBusGMainLoop())
+    player_name = None
+    if args.player:
+        player_name = get_player_name(bus, args)
+    PlayerWatcher(bus, GLib, args.format, player_name=player_name)
+    try:
+        GLib.MainLoop().run()
+    except KeyboardInterrupt:
+        pass
+
+
+class PlayerWatcher:
+    """Print player info each time it changes, from D-Bus signals.
+
+    The watched player is player_name if set, else the active player of a
+    PlayerCache, which changes when another player starts playing.
+
+    The position is not part of PropertiesChanged signals: it is fetched when
+    the track or playback status changes and after Seeked signals, then
+    extrapolated with the playback rate. While playing, a timer is set for the
+    next time the displayed position changes, and removed otherwise.
+    """
+
+    def __init__(self, bus, glib, info_format=DEFAULT_INFO_FORMAT,
+                 player_name=None):
+        self.bus = bus
+        self.glib = glib
+        self.info_format = info_format
+        self.properties = {}
+        self.position = 0
+        self.position_time = time.monotonic()
+        self.last_line = None
+        self.timer = None
+        self.player = None
+        self.owner = None
+        bus.add_signal_receiver(
+            self.on_properties_changed, "PropertiesChanged",
+            dbus_interface=dbus.PROPERTIES_IFACE, path=CLEM_PATH,
+            sender_keyword="sender",
+        )
+        bus.add_signal_receiver(
+            self.on_seeked, "Seeked", dbus_interface=CLEM_PLAYER_NAME,
+            path=CLEM_PATH, sender_keyword="sender",
+        )
+        if player_name:
+            bus.watch_name_owner(player_name, self.on_owner_changed)
+        else:
+            self.players = PlayerCache(bus, self.on_active_changed)
+            self.players.listen()
+
+    def on_active_changed(self, name):
+        self.on_owner_changed(self.players.owners.get(name))
+
+    def on_owner_changed(self, owner):
+        self.properties = {}
+        self.player = None
+        self.owner = owner or None
+        if owner:
+            try:
+                self.player = self.bus.get_object(owner, CLEM_PATH)
+                self.properties = get_player_properties(self.player)
+            except dbus.exceptions.DBusException:
+                pass
+        self.set_position(self.properties.get("Position", 0))
+        self.update()
+
+    def on_properties_changed(self, interface, changed, invalidated,
+                              sender=None):
+        if interface != CLEM_PLAYER_NAME or sender != self.owner:
+            return
+        position = self.get_position()
+        self.properties.update(changed)
+        for name in invalidated:
+            self.properties[name] = self.get_property(name)
+        if "Metadata" in changed or "PlaybackStatus" in changed:
+            position = self.get_property("Position", position)
+        self.set_position(position)
+        self.update()
+
+    def on_seeked(self, position, sender=None):
+        if sender != self.owner:
+            return
+        self.set_position(position)
+        self.update()
+
+    def get_property(self, name, default=None):
+        if self.player is None:
+            return default
+        try:
+            return self.player.Get(CLEM_PLAYER_NAME, name,
+                                   dbus_interface=dbus.PROPERTIES_IFACE)
+        except dbus.exceptions.DBusException:
+            return default
+
+    def is_playing(self):
+        return self.properties.get("PlaybackStatus") == "Playing"
+
+    def set_position(self, position):
+        self.position = int(position)
+        self.position_time = time.monotonic()
+
+    def get_position(self):
+        """Return the current position in microseconds."""
+        if not self.is_playing():
+            return self.position
+        rate = float(self.properties.get("Rate", 1.0))
+        elapsed = time.monotonic() - self.position_time
+        return self.position + int(elapsed * rate * 1_000_000)
+
+    def update(self):
+        """Print the info line if it changed and schedule the next update."""
+        if self.timer is not None:
+            self.glib.source_remove(self.timer)
+            self.timer = None
+        if self.properties:
+            properties = dict(self.properties, Position=self.get_position())
+            line = format_info(properties, self.info_format)
+        else:
+            line = ""
+        if line != self.last_line:
+            print(line, flush=True)
+            self.last_line = line
+        if self.is_playing() and "{position" in self.info_format:
+            rate = float(self.properties.get("Rate", 1.0)) or 1.0
+            to_next_second = 1_000_000 - self.get_position() % 1_000_000
+            delay_ms = int(to_next_second / rate / 1000) + 1
+            self.timer = self.glib.timeout_add(delay_ms, self.on_timer)
+
+    def on_timer(self):
+        self.timer = None
+        self.update()
+        return False
+
+
+def handle_batch_command(args):
+    try:
+        import dbus_next  # type: ignore
+    except ImportError:
+        dbus_next = None
+    for command in args.commands:
+        if command not in BATCH_COMMANDS:
+            exit(f"Unknown command {command}.")
+    if "info" in args.commands:
+        check_info_format(args.format)
+    if args.benchmark:
+        if dbus_next is None:
+            exit("The benchmark requires dbus-next.")
+        run_batch_benchmark(args)
+        return
+    if not args.commands:
+        exit("No commands to run.")
+    if dbus_next is None:
+        bus = get_bus(args)
+        clem_object = get_clementine_object(bus, get_player_name(bus, args))
+        values = run_batch_sync(clem_object, args.commands)
+    else:
+        try:
+            values = asyncio.run(run_batch_async(args, args.commands))
+        except dbus_next.errors.DBusError as exc:
+            if not args.quiet:
+                sys.stderr.write(f"{exc.text}\n")
+            sys.exit(1)
+    for command, value in zip(args.commands, values):
+        line = format_batch_value(command, value, args.format)
+        if line is not None:
+            print(line)
+
+
+def format_batch_value(command, value, info_format=DEFAULT_INFO_FORMAT):
+    """Return the line to print for a batch command, or None."""
+    if command in BATCH_METHODS:
+        return None
+    if command == "info":
+        return format_info(value, info_format)
+    if command == "position":
+        return format_position(value)
+    return str(value)
+
+
+def run_batch_sync(clem_object, commands):
+    """Run batch commands with dbus-python, one round trip after another."""
+    values = []
+    for command in commands:
+        if command in BATCH_METHODS:
+            interface = get_player_interface(clem_object)
+            getattr(interface, BATCH_METHODS[command])()
+            values.append(None)
+        elif command == "info":
+            values.append(get_player_properties(clem_object))
+        else:
+            values.append(clem_object.Get(
+                CLEM_PLAYER_NAME, BATCH_PROPERTIES[command],
+                dbus_interface=dbus.PROPERTIES_IFACE,
+            ))
+    return values
+
+
+async def run_batch_async(args, commands):
+    from dbus_next.aio import MessageBus  # type: ignore
+
+    bus = await MessageBus(bus_address=args.bus).connect()
+    try:
+        name = await get_player_name_async(bus, args)
+        return await call_batch(bus, name, commands)
+    finally:
+        bus.disconnect()
+
+
+async def call_batch(bus, name, commands, pipeline=True):
+    """Run batch commands with dbus-next and return their values.
+
+    With pipeline, all calls are sent before waiting for the first reply.
+    """
+    messages = [make_batch_message(name, command) for command in commands]
+    if pipeline:
+        replies = await asyncio.gather(*map(bus.call, messages))
+    else:
+        replies = [await bus.call(message) for message in messages]
+    return [get_reply_value(reply) for reply in replies]
+
+
+def make_batch_message(name, command):
+    from dbus_next import Message  # type: ignore
+
+    if command in BATCH_METHODS:
+        return Message(destination=name, path=CLEM_PATH,
+                       interface=CLEM_PLAYER_NAME,
+                       member=BATCH_METHODS[command])
+    if command == "info":
+        return Message(destination=name, path=CLEM_PATH,
+                       interface=dbus.PROPERTIES_IFACE, member="GetAll",
+                       signature="s", body=[CLEM_PLAYER_NAME])
+    return Message(destination=name, path=CLEM_PATH,
+                   interface=dbus.PROPERTIES_IFACE, member="Get",
+                   signature="ss",
+                   body=[CLEM_PLAYER_NAME, BATCH_PROPERTIES[command]])
+
+
+def get_reply_value(reply):
+    """Return the first value of a dbus-next reply, without variants."""
+    from dbus_next import MessageType  # type: ignore
+    from dbus_next.errors import DBusError  # type: ignore
+
+    if reply.message_type == MessageType.ERROR:
+        text = reply.body[0] if reply.body else reply.error_name
+        raise DBusError(reply.error_name, text, reply)
+    return unpack_variants(reply.body[0]) if reply.body else None
+
+
+def unpack_variants(value):
+    from dbus_next import Variant  # type: ignore
+
+    if isinstance(value, Variant):
+        return unpack_variants(value.value)
+    if isinstance(value, dict):
+        return {key: unpack_variants(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [unpack_variants(item) for item in value]
+    return value
+
+
+async def call_bus_method(bus, member, signature="", body=None):
+    from dbus_next import Message  # type: ignore
+
+    message = Message(destination=DBUS_NAME, path=DBUS_PATH,
+                      interface=DBUS_NAME, member=member,
+                      signature=signature, body=body or [])
+    return get_reply_value(await bus.call(message))
+
+
+async def get_player_name_async(bus, args):
+    """Same as get_player_name, for a dbus-next bus."""
+    if args.player:
+        return get_full_player_name(args.player)
+    from dbus_next.errors import DBusError  # type: ignore
+
+    active_name = load_active_player()
+    if active_name:
+        try:
+            if await call_batch(bus, active_name, ["status"]) == ["Playing"]:
+                return active_name
+        except DBusError:
+            pass
+    names = sorted(
+        name for name in await call_bus_method(bus, "ListNames")
+        if name.startswith(MPRIS_PREFIX)
+    )
+    statuses = await asyncio.gather(
+        *(call_batch(bus, name, ["status"]) for name in names),
+        return_exceptions=True,
+    )
+    for name, status in zip(names, statuses):
+        if status == ["Playing"]:
+            break
+    else:
+        if not names:
+            return CLEM_NAME
+        if active_name in names:
+            name = active_name
+        else:
+            name = CLEM_NAME if CLEM_NAME in names else names[0]
+    save_active_player(name)
+    return name
+
+
+def run_batch_benchmark(args):
+    import subprocess
+
+    commands = args.commands or BENCHMARK_COMMANDS
+    mock_command = [sys.executable, os.path.abspath(__file__)]
+    if args.bus:
+        mock_command += ["--bus", args.bus]
+    mock_process = subprocess.Popen(mock_command + ["mock-player"])
+    try:
+        timings = asyncio.run(benchmark_async(args, commands))
+        clem_object = get_clementine_object(get_bus(args), MOCK_NAME)
+        timings["dbus-python, serial"] = time_runs(
+            lambda: run_batch_sync(clem_object, commands), args.benchmark
+        )
+    finally:
+        mock_process.terminate()
+        mock_process.wait()
+    print(f"{args.benchmark} runs of: {' '.join(commands)}")
+    for label, durations in timings.items():
+        durations.sort()
+        mean_ms = sum(durations) / len(durations) * 1000
+        p95_ms = durations[int(len(durations) * 0.95)] * 1000
+        print(f"{label}: mean {mean_ms:.3f} ms, p95 {p95_ms:.3f} ms")
+
+
+async def benchmark_async(args, commands):
+    from dbus_next.aio import MessageBus  # type: ignore
+
+    bus = await MessageBus(bus_address=args.bus).connect()
+    try:
+        deadline = time.monotonic() + 5
+        while not await call_bus_method(bus, "NameHasOwner", "s", [MOCK_NAME]):
+            if time.monotonic() > deadline:
+                exit("The mock player did not start.")
+            await asyncio.sleep(0.01)
+        timings = {}
+        for label, pipeline in (("dbus-next, serial", False),
+                                ("dbus-next, pipelined", True)):
+            durations = []
+            for _ in range(args.benchmark):
+                start = time.perf_counter()
+                await call_batch(bus, MOCK_NAME, commands, pipeline)
+                durations.append(time.perf_counter() - start)
+            timings[label] = durations
+        return timings
+    finally:
+        bus.disconnect()
+
+
+def time_runs(function, num_runs):
+    durations = []
+    for _ in range(num_runs):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def handle_mock_player_command(args):
+    asyncio.run(run_mock_player(args))
+
+
+async def run_mock_player(args):
+    """Serve a fake MPRIS player with a few tracks until terminated."""
+    import signal
+    from dbus_next import PropertyAccess, Variant  # type: ignore
+    from dbus_next.aio import MessageBus  # type: ignore
+    from dbus_next.service import (  # type: ignore
+        ServiceInterface, dbus_property, method, signal as dbus_signal
+    )
+
+    class MockPlayer(ServiceInterface):
+        def __init__(self):
+            super().__init__(CLEM_PLAYER_NAME)
+            self.status = "Stopped"
+            self.track = 0
+            self.position = 0
+
+        def set_status(self, status):
+            self.status = status
+            self.emit_properties_changed({"PlaybackStatus": status})
+
+        def set_track(self, track):
+            self.track = track % 10
+            self.position = 0
+            self.emit_properties_changed({"Metadata": self.Metadata})
+
+        @method()
+        def Play(self):
+            self.set_status("Playing")
+
+        @method()
+        def PlayPause(self):
+            self.set_status("Paused" if self.status == "Playing"
+                            else "Playing")
+
+        @method()
+        def Pause(self):
+            self.set_status("Paused")
+
+        @method()
+        def Stop(self):
+            self.position = 0
+            self.set_status("Stopped")
+
+        @method()
+        def Previous(self):
+            self.set_track(self.track - 1)
+
+        @method()
+        def Next(self):
+            self.set_track(self.track + 1)
+
+        @method()
+        def Seek(self, offset: "x"):
+            self.position = max(0, self.position + offset)
+            self.Seeked()
+
+        @dbus_signal()
+        def Seeked(self) -> "x":
+            return self.position
+
+        @dbus_property(access=PropertyAccess.READ)
+        def PlaybackStatus(self) -> "s":
+            return self.status
+
+        @dbus_property(access=PropertyAccess.READ)
+        def Position(self) -> "x":
+            return self.position
+
+        @dbus_property(access=PropertyAccess.READ)
+        def Rate(self) -> "d":
+            return 1.0
+
+        @dbus_property(access=PropertyAccess.READ)
+        def Volume(self) -> "d":
+            return 0.5
+
+        @dbus_property(access=PropertyAccess.READ)
+        def Metadata(self) -> "a{sv}":
+            return {
+                "mpris:length": Variant("x", 180_000_000),
+                "xesam:artist": Variant("as", ["Mock Artist"]),
+                "xesam:title": Variant("s", f"Track {self.track + 1}"),
+            }
+
+    bus = await MessageBus(bus_address=args.bus).connect()
+    bus.export(CLEM_PATH, MockPlayer())
+    await bus.request_name(MOCK_NAME)
+    stop = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        bus.disconnect()
+
+
 if __name__ == "__main__":
     main()
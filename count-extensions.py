@@ -1,11 +1,356 @@
 #!/usr/bin/env python3
-# Dumb script to print statistics of file extensions in the current directory.
+# Dumb script to print statistics of file extensions in a directory, by default
+# the current one.
+#
+# Directories are listed with os.scandir by a pool of threads, so that many
+# directory reads are waiting on the file system at the same time, which helps
+# a lot on network file systems or fast SSDs. Use --benchmark to compare it with
+# a simple os.walk on a generated tree.
+#
+# With --sizes, the total, largest, mean and median sizes of files are also
+# given per extension, and with --by-top-dir all statistics are split by
+# top-level directory. Sizes come from the same scandir entries and are kept in
+# small histograms, so memory grows with the number of extensions, not files;
+# the median is approximate as a consequence (about 6% at worst).
+#
+# For trees that are scanned often but change little, --cache stores the
+# counts and modification time of each directory in an SQLite file. On the
+# next runs, directories are still stat'ed but only those whose modification
+# time changed are listed again. A directory modification time only changes
+# when entries are added, removed or renamed in it, so sizes of files modified
+# in place are not refreshed; remove the cache file to start from scratch.
+#
+# Directories and files can be left out with gitignore-like patterns given with
+# --prune or read from a file with --prune-from (--prune-common skips usual VCS
+# and dependency directories). Pruned directories are never listed. Negated
+# patterns are not supported, and "*" also matches slashes. With -x, the scan
+# stays on the file system of the scanned folder. On long scans, --ndjson
+# prints the current top extensions as JSON lines every few seconds, and all
+# results as a last line.
 
+import argparse
+import concurrent.futures
+import fnmatch
+import json
 import os
 import os.path
+import re
+import sqlite3
+import tempfile
+import time
 from collections import defaultdict
 
-def count_extensions(folder):
+COMMON_PRUNE = [
+    ".git/", ".hg/", ".svn/", "node_modules/", "__pycache__/", ".venv/",
+    ".tox/", ".mypy_cache/", ".pytest_cache/",
+]
+
+class SizeStats:
+    """Count and sizes of a group of files, with an histogram of sizes.
+
+    Sizes are put in buckets of 8 per power of two, so the histogram never has
+    more than a few hundred entries.
+    """
+
+    __slots__ = ("count", "total", "largest", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.largest = 0
+        self.buckets = defaultdict(int)
+
+    def add(self, size):
+        self.count += 1
+        self.total += size
+        self.largest = max(self.largest, size)
+        if size < 8:
+            self.buckets[size] += 1
+        else:
+            exp = size.bit_length() - 4
+            self.buckets[(exp + 1) * 8 + ((size >> exp) & 7)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.total += other.total
+        self.largest = max(self.largest, other.largest)
+        for bucket, n in other.buckets.items():
+            self.buckets[bucket] += n
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def median(self):
+        """Return the middle of the bucket holding the median size."""
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen * 2 >= self.count:
+                break
+        else:
+            return 0
+        if bucket < 8:
+            return bucket
+        exp = bucket // 8 - 1
+        return ((8 + bucket % 8) << exp) + (1 << exp) // 2
+
+    def to_list(self):
+        return [self.count, self.total, self.largest, list(self.buckets.items())]
+
+    @staticmethod
+    def from_list(values):
+        stats = SizeStats()
+        stats.count, stats.total, stats.largest, buckets = values
+        stats.buckets.update(buckets)
+        return stats
+
+class PruneRules:
+    """Match paths against gitignore-like patterns.
+
+    Patterns without a slash match names at any depth, other patterns match
+    paths relative to the scanned folder. A trailing slash restricts a
+    pattern to directories. Comments and blank lines are ignored.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = []
+        groups = defaultdict(list)
+        for pattern in patterns:
+            pattern = pattern.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            self.patterns.append(pattern)
+            dir_only = pattern.endswith("/")
+            pattern = pattern.rstrip("/")
+            anchored = "/" in pattern
+            groups[(anchored, dir_only)].append(
+                fnmatch.translate(pattern.lstrip("/"))
+            )
+        self.regexes = {
+            group: re.compile("|".join(regexes)).match
+            for group, regexes in groups.items()
+        }
+
+    def match(self, rel_path, name, is_dir):
+        for (anchored, dir_only), match in self.regexes.items():
+            if (is_dir or not dir_only) and match(rel_path if anchored else name):
+                return True
+        return False
+
+def count_extensions(folder, jobs=16, sizes=False, by_top_dir=False,
+                     cache=None, prune=None, one_file_system=False,
+                     progress=None):
+    """Return statistics per extension of files in folder.
+
+    Statistics are the number of files, or SizeStats if sizes is true. Keys
+    are extensions, or (top-level directory, extension) if by_top_dir is
+    true, "." being the top-level directory of files directly in folder.
+    If cache is the path of an SQLite file, it is used to skip listing
+    directories that did not change since the last call, and updated.
+    Paths matching the PruneRules prune are skipped, as are mount points if
+    one_file_system is true. If progress is set, it is called with the
+    statistics and the number of scanned directories after each directory.
+    """
+    stats = defaultdict(SizeStats if sizes else int)
+    if cache is not None:
+        folder = os.path.abspath(folder)
+    device = os.stat(folder).st_dev if one_file_system else None
+    scan_args = (sizes, prune, folder, device)
+    if cache is not None:
+        # Anchored prune patterns are relative to the scanned folder.
+        settings = json.dumps(
+            [sizes, prune.patterns if prune else [], one_file_system, folder]
+        )
+        db = open_cache(cache)
+        cached_dirs = load_cache(db, folder, settings)
+        updates = []
+
+    def submit(path):
+        if cache is None:
+            return executor.submit(scan_dir, path, *scan_args)
+        return executor.submit(scan_dir_cached, path, scan_args, settings,
+                               cached_dirs.pop(path, None), updates)
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        pending = {submit(folder): "."}
+        num_dirs = 0
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                top_dir = pending.pop(future)
+                counts, subdirs = future.result()
+                for ext, n in counts.items():
+                    key = (top_dir, ext) if by_top_dir else ext
+                    if sizes:
+                        stats[key].merge(n)
+                    else:
+                        stats[key] += n
+                for subdir in subdirs:
+                    sub_top_dir = top_dir
+                    if top_dir == ".":
+                        sub_top_dir = os.path.basename(subdir)
+                    pending[submit(subdir)] = sub_top_dir
+                num_dirs += 1
+                if progress:
+                    progress(stats, num_dirs)
+
+    if cache is not None:
+        with db:
+            db.executemany("DELETE FROM dirs WHERE path = ?",
+                           ((path,) for path in cached_dirs))
+            db.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?, ?, ?)",
+                           updates)
+        db.close()
+    return stats
+
+def open_cache(path):
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS dirs (path TEXT PRIMARY KEY, mtime INTEGER, "
+        "settings TEXT, counts TEXT, subdirs TEXT)"
+    )
+    return db
+
+def load_cache(db, folder, settings):
+    """Return cached rows for folder and its subdirectories, by path.
+
+    Rows are (mtime, counts, subdirs), counts and subdirs being still encoded
+    as JSON, as most of them may not be needed. Rows made with different
+    settings are ignored and will be replaced.
+    """
+    prefix = os.path.join(folder, "")
+    rows = db.execute(
+        "SELECT path, mtime, settings, counts, subdirs FROM dirs "
+        "WHERE path = ? OR substr(path, 1, ?) = ?",
+        (folder, len(prefix), prefix),
+    )
+    return {
+        path: (mtime if row_settings == settings else None, counts, subdirs)
+        for path, mtime, row_settings, counts, subdirs in rows
+    }
+
+def scan_dir_cached(folder, scan_args, settings, cached, updates):
+    """Like scan_dir, but use the cached row if the folder did not change.
+
+    If the folder is listed, a row to cache is appended to updates.
+    """
+    sizes = scan_args[0]
+    try:
+        mtime = os.stat(folder).st_mtime_ns
+    except OSError:
+        return {}, []
+    if cached is not None and cached[0] == mtime:
+        counts, subdirs = json.loads(cached[1]), json.loads(cached[2])
+        if sizes:
+            counts = {e: SizeStats.from_list(v) for e, v in counts.items()}
+        return counts, subdirs
+    counts, subdirs = scan_dir(folder, *scan_args)
+    encoded = {e: v.to_list() for e, v in counts.items()} if sizes else counts
+    updates.append(
+        (folder, mtime, settings, json.dumps(encoded), json.dumps(subdirs))
+    )
+    return counts, subdirs
+
+def scan_dir(folder, sizes=False, prune=None, root=None, device=None):
+    """Count extensions of files directly in folder and list its subdirs.
+
+    Counts are SizeStats if sizes is true. Like os.walk, unreadable directories
+    are ignored and symbolic links to directories are not followed, nor
+    counted as files. Sizes of symbolic links are their own. Entries matching
+    prune, with paths relative to root, are skipped, as are subdirectories not
+    on device if it is set.
+    """
+    counts = defaultdict(SizeStats if sizes else int)
+    subdirs = []
+    rel_folder = os.path.relpath(folder, root) if prune else ""
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if prune and prune.match(
+                    os.path.normpath(os.path.join(rel_folder, entry.name)),
+                    entry.name,
+                    is_dir,
+                ):
+                    continue
+                if is_dir:
+                    if entry.is_symlink():
+                        continue
+                    if (
+                        device is not None
+                        and entry.stat(follow_symlinks=False).st_dev != device
+                    ):
+                        continue
+                    subdirs.append(entry.path)
+                    continue
+                ext = os.path.splitext(entry.name)[1].lstrip(".")
+                if sizes:
+                    try:
+                        size = entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        size = 0
+                    counts[ext].add(size)
+                else:
+                    counts[ext] += 1
+    except OSError:
+        pass
+    return counts, subdirs
+
+def sort_stats(stats, sizes=False):
+    """Return statistics items by decreasing count, or total size."""
+    if sizes:
+        return sorted(stats.items(),
+                      key=lambda item: (-item[1].total, item[0]))
+    return sorted(stats.items(), key=lambda item: (item[1], item[0]),
+                  reverse=True)
+
+def stats_to_dicts(stats_list, by_top_dir=False):
+    rows = []
+    for key, s in stats_list:
+        row = {"dir": key[0], "ext": key[1]} if by_top_dir else {"ext": key}
+        if isinstance(s, SizeStats):
+            row.update(files=s.count, total=s.total, largest=s.largest,
+                       mean=round(s.mean()), median=s.median())
+        else:
+            row["files"] = s
+        rows.append(row)
+    return rows
+
+class NdjsonProgress:
+    """Print partial top statistics as JSON lines, at most every interval."""
+
+    def __init__(self, sizes, by_top_dir, top=10, interval=1.0):
+        self.sizes = sizes
+        self.by_top_dir = by_top_dir
+        self.top = top
+        self.interval = interval
+        self.start = self.last = time.monotonic()
+        self.num_dirs = 0
+
+    def __call__(self, stats, num_dirs):
+        self.num_dirs = num_dirs
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.print(stats, top=self.top)
+
+    def print(self, stats, top=None, done=False):
+        files = sum(s.count if self.sizes else s for s in stats.values())
+        stats_list = sort_stats(stats, self.sizes)[:top]
+        print(json.dumps({
+            "elapsed": round(time.monotonic() - self.start, 3),
+            "dirs": self.num_dirs,
+            "files": files,
+            "done": done,
+            "stats": stats_to_dicts(stats_list, self.by_top_dir),
+        }), flush=True)
+
+def count_extensions_walk(folder):
     stats = defaultdict(int)
     for (root, dirs, files) in os.walk(folder):
         for f in files:
@@ -13,8 +358,101 @@ def count_extensions(folder):
             stats[ext] += 1
     return stats
 
+def benchmark(num_dirs, files_per_dir, jobs):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        print("Generating {} directories of {} files...".format(
+            num_dirs, files_per_dir
+        ))
+        extensions = ["txt", "py", "c", "h", "png", "", "tar.gz"]
+        for i in range(num_dirs):
+            # Nest directories a bit so the walk is not a single listing.
+            path = os.path.join(tmp_dir, str(i % 10), str(i % 100), str(i))
+            os.makedirs(path)
+            for j in range(files_per_dir):
+                ext = extensions[j % len(extensions)]
+                name = "f{}.{}".format(j, ext) if ext else "f{}".format(j)
+                open(os.path.join(path, name), "w").close()
+
+        start = time.perf_counter()
+        walk_stats = count_extensions_walk(tmp_dir)
+        walk_time = time.perf_counter() - start
+        start = time.perf_counter()
+        stats = count_extensions(tmp_dir, jobs=jobs)
+        scandir_time = time.perf_counter() - start
+        print("os.walk: {:.3f}s".format(walk_time))
+        print("scandir with {} threads: {:.3f}s".format(jobs, scandir_time))
+        print("identical: {}".format(stats == walk_stats))
+
 if __name__ == "__main__":
-    stats = count_extensions(".")
-    stats_list = reversed(sorted([(n, e) for e, n in stats.items()]))
-    for n, e in stats_list:
-        print("{}\t{}".format(n, e))
+    ap = argparse.ArgumentParser()
+    ap.add_argument("folder", nargs="?", default=".")
+    ap.add_argument("-j", "--jobs", type=int, default=16,
+                    help="number of directories listed at once (default 16)")
+    ap.add_argument("-s", "--sizes", action="store_true",
+                    help="show sizes per extension, sorted by total size")
+    ap.add_argument("-t", "--by-top-dir", action="store_true",
+                    help="split statistics by top-level directory")
+    ap.add_argument("-c", "--cache",
+                    help="SQLite file to cache directory listings in")
+    ap.add_argument("-p", "--prune", action="append", default=[],
+                    help="skip paths matching this gitignore-like pattern")
+    ap.add_argument("--prune-from", action="append", default=[],
+                    help="read patterns to skip from this file")
+    ap.add_argument("-P", "--prune-common", action="store_true",
+                    help="skip VCS, dependency and cache directories")
+    ap.add_argument("-x", "--one-file-system", action="store_true",
+                    help="do not cross file system boundaries")
+    ap.add_argument("--ndjson", action="store_true",
+                    help="stream partial statistics as JSON lines")
+    ap.add_argument("-n", "--top", type=int, default=10,
+                    help="number of partial statistics in JSON lines")
+    ap.add_argument("-i", "--interval", type=float, default=1.0,
+                    help="seconds between JSON lines (default 1)")
+    ap.add_argument("--benchmark", type=int, nargs=2, metavar=("DIRS", "FILES"),
+                    help="compare with os.walk on a generated tree")
+    args = ap.parse_args()
+    if args.benchmark:
+        benchmark(*args.benchmark, args.jobs)
+        raise SystemExit()
+
+    patterns = args.prune + (COMMON_PRUNE if args.prune_common else [])
+    for prune_file_name in args.prune_from:
+        try:
+            with open(prune_file_name, "rt") as prune_file:
+                patterns += prune_file.readlines()
+        except OSError as exc:
+            exit("Can't read prune file: {}".format(exc))
+    progress = None
+    if args.ndjson:
+        progress = NdjsonProgress(args.sizes, args.by_top_dir, top=args.top,
+                                  interval=args.interval)
+    stats = count_extensions(
+        args.folder,
+        jobs=args.jobs,
+        sizes=args.sizes,
+        by_top_dir=args.by_top_dir,
+        cache=args.cache,
+        prune=PruneRules(patterns) if patterns else None,
+        one_file_system=args.one_file_system,
+        progress=progress,
+    )
+    if args.ndjson:
+        progress.print(stats, done=True)
+        raise SystemExit()
+    stats_list = sort_stats(stats, args.sizes)
+    if args.sizes:
+        print("files\ttotal\tlargest\tmean\tmedian\t{}ext".format(
+            "dir\t" if args.by_top_dir else ""
+        ))
+        for key, s in stats_list:
+            if not args.by_top_dir:
+                key = (key,)
+            print("{}\t{}\t{}\t{:.0f}\t{}\t{}".format(
+                s.count, s.total, s.largest, s.mean(), s.median(),
+                "\t".join(key)
+            ))
+    else:
+        for e, n in stats_list:
+            if args.by_top_dir:
+                e = "\t".join(e)
+            print("{}\t{}".format(n, e))
@@ -7,20 +7,81 @@ It's mainly useful if you work with terminals around and don't want to keep the
 Nectarine tab under your eyes all the time (even if it's raina's design).
 Respect their servers, and long live Nectarine!
 
+With --follow, the script stays running and prints each new track. It keeps a
+single HTTP connection open and sends conditional requests, so the queue is
+only downloaded and parsed again when it changed. The next request is
+scheduled for the end of the current track, from its playstart and length, so
+there is about one request per track; the --interval delay is only used when
+the end of the track is unknown or already passed. Playstart times without a
+timezone are assumed to be UTC. Use --url to poll another server, e.g. a local
+copy of the queue served with "python3 -m http.server".
+
+Responses are parsed with iterparse over the raw bytes instead of building a
+whole tree: to get the current track, parsing stops at the first entry of the
+"now" section. Use --section to print the entries of other sections, e.g.
+"queue" or "history"; each entry is cleared from the tree once parsed, and
+records use slots. --benchmark compares both parsers on a synthetic queue.
+
+With --record, the tracks of the "now" and "history" sections are added to a
+SQLite play history (see --db), and with --follow each new track is added as
+it starts. Plays are unique by playstart and song, and indexed by date, song,
+title, requester and artist, the playstart being copied in the artists table,
+so query options like --top-requesters or --last-played answer from the local
+history in milliseconds, without fetching anything.
+
 Requirements: the requests package.
 """
 
+import argparse
+import io
+import os
+import sqlite3
 import sys
+import time
 import xml.etree.ElementTree as ElementTree
 from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
 
 import requests
 
 QUEUE_URL = "https://scenestream.net/demovibes/xml/queue/"
+TIMEOUT = 10
+POLL_INTERVAL = 30
+# Delay after the expected end of a track, for the queue to be updated.
+END_MARGIN = 2
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    id INTEGER PRIMARY KEY,
+    playstart TEXT NOT NULL,
+    request_time TEXT,
+    song_id INTEGER,
+    title TEXT,
+    length TEXT,
+    requester TEXT,
+    requester_flag TEXT,
+    UNIQUE (playstart, song_id)
+);
+CREATE TABLE IF NOT EXISTS play_artists (
+    play_id INTEGER NOT NULL REFERENCES plays (id),
+    playstart TEXT NOT NULL,
+    artist_id INTEGER,
+    name TEXT,
+    flag TEXT
+);
+CREATE INDEX IF NOT EXISTS plays_song ON plays (song_id, playstart);
+CREATE INDEX IF NOT EXISTS plays_title ON plays (title COLLATE NOCASE);
+CREATE INDEX IF NOT EXISTS plays_requester ON plays (requester, playstart);
+CREATE INDEX IF NOT EXISTS play_artists_play ON play_artists (play_id);
+CREATE INDEX IF NOT EXISTS play_artists_date
+    ON play_artists (playstart, artist_id, name);
+CREATE INDEX IF NOT EXISTS play_artists_name
+    ON play_artists (name COLLATE NOCASE);
+"""
 
 
 @dataclass
 class Artist:
+    __slots__ = ("ident", "flag", "name")
     ident: int
     flag: str
     name: str
@@ -28,6 +89,7 @@ class Artist:
 
 @dataclass
 class Song:
+    __slots__ = ("ident", "length", "title")
     ident: int
     length: str
     title: str
@@ -35,12 +97,14 @@ class Song:
 
 @dataclass
 class Requester:
+    __slots__ = ("flag", "name")
     flag: str
     name: str
 
 
 @dataclass
 class Entry:
+    __slots__ = ("request_time", "artists", "song", "requester", "playstart")
     request_time: str
     artists: list[Artist]
     song: Song
@@ -50,11 +114,60 @@ class Entry:
 
 def get_queue_xml(url=QUEUE_URL):
     """Return the XML tree from the API, or None on error."""
-    response = requests.get(url)
-    if response.status_code != 200:
-        sys.stderr.write(f"Failed to open URL: {QUEUE_URL}")
-        return None
-    return ElementTree.XML(response.text)
+    return QueueClient(url, parse=parse_queue_xml).fetch()
+
+
+def parse_queue_xml(source):
+    """Return the root of the XML tree read from a binary file object."""
+    return ElementTree.parse(source).getroot()
+
+
+class QueueClient:
+    """Fetch the queue XML repeatedly, reusing the connection.
+
+    The response body is given as a binary file object to parse, which
+    defaults to parse_now_playing. Requests are conditional on the ETag and
+    Last-Modified headers of the previous response; if the server answers
+    that the queue did not change, the previous result of parse is returned.
+    """
+
+    def __init__(self, url=QUEUE_URL, timeout=TIMEOUT, parse=None):
+        self.url = url
+        self.timeout = timeout
+        self.parse = parse or parse_now_playing
+        self.session = requests.Session()
+        self.etag = None
+        self.last_modified = None
+        self.result = None
+
+    def fetch(self):
+        """Return the parsed response, or None on error or invalid XML."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        try:
+            response = self.session.get(self.url, headers=headers,
+                                        timeout=self.timeout)
+        except requests.RequestException as exc:
+            sys.stderr.write(f"Failed to open URL: {self.url} ({exc})\n")
+            return None
+        if response.status_code == 304 and self.result is not None:
+            return self.result
+        if response.status_code != 200:
+            sys.stderr.write(f"Failed to open URL: {self.url}\n")
+            return None
+        # The whole body is read so the connection goes back to the pool.
+        try:
+            result = self.parse(io.BytesIO(response.content))
+        except ElementTree.ParseError as exc:
+            sys.stderr.write(f"Invalid XML from {self.url} ({exc})\n")
+            return None
+        self.etag = response.headers.get("ETag")
+        self.last_modified = response.headers.get("Last-Modified")
+        self.result = result
+        return result
 
 
 def get_now_playing(queue_xml):
@@ -63,6 +176,48 @@ def get_now_playing(queue_xml):
     return parse_entry(entry_node)
 
 
+def iter_entries(source):
+    """Yield (section, Entry) pairs from a binary file object, in order.
+
+    The section is the tag of the parent of the entry node, e.g. "now". As
+    only end events are parsed, entries are yielded when their section ends.
+    Nodes are cleared once parsed so the tree stays small.
+    """
+    entries = []
+    for _, node in ElementTree.iterparse(source):
+        if node.tag == "entry":
+            entries.append(parse_entry(node))
+            node.clear()
+        elif entries and node[-1:] and node[-1].tag == "entry":
+            for entry in entries:
+                yield node.tag, entry
+            entries = []
+            node.clear()
+
+
+def parse_now_playing(source):
+    """Return the Entry of the currently playing song, or None.
+
+    Parsing stops as soon as the entry is found.
+    """
+    for section, entry in iter_entries(source):
+        if section == "now":
+            return entry
+    return None
+
+
+def parse_queue(source, sections=None):
+    """Return a dict of section names to lists of entries.
+
+    If sections is given, only entries of these sections are kept.
+    """
+    queue = {}
+    for section, entry in iter_entries(source):
+        if sections is None or section in sections:
+            queue.setdefault(section, []).append(entry)
+    return queue
+
+
 def parse_entry(entry_node) -> Entry:
     artists = entry_node.findall("artist")
     song = entry_node.find("song")
@@ -91,13 +246,149 @@ def parse_entry(entry_node) -> Entry:
     )
 
 
+def parse_playstart(playstart):
+    """Return the playstart of an entry as an aware datetime."""
+    start = datetime.fromisoformat(playstart.strip().replace("Z", "+00:00"))
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    return start
+
+
+def parse_length(length):
+    """Return a song length like "3:45" or "1:02:03" as a timedelta."""
+    seconds = 0
+    for part in length.split(":"):
+        seconds = seconds * 60 + int(part)
+    return timedelta(seconds=seconds)
+
+
+def get_next_fetch_delay(entry, interval=POLL_INTERVAL, now=None):
+    """Return how many seconds to wait before fetching the queue again.
+
+    It is the time until the end of the entry, or interval if it is unknown,
+    passed or longer than the song, e.g. because of a timezone mismatch.
+    """
+    try:
+        start = parse_playstart(entry.playstart)
+        length = parse_length(entry.song.length)
+    except (AttributeError, TypeError, ValueError):
+        return interval
+    now = now or datetime.now(timezone.utc)
+    remaining = (start + length - now).total_seconds()
+    if remaining <= 0 or remaining > length.total_seconds():
+        return interval
+    return remaining + END_MARGIN
+
+
+def follow(client, interval=POLL_INTERVAL, db=None):
+    """Print each new entry, fetching the queue about once per track.
+
+    If db is set, each new entry is also added to this play history.
+    """
+    last_entry = None
+    while True:
+        delay = interval
+        entry = client.fetch()
+        if entry is not None:
+            if entry != last_entry:
+                print(format_entry(entry), flush=True)
+                if db is not None:
+                    record_plays(db, [entry])
+                last_entry = entry
+            delay = get_next_fetch_delay(entry, interval)
+        time.sleep(delay)
+
+
 def main():
-    queue_xml = get_queue_xml()
-    if queue_xml is None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=QUEUE_URL,
+                        help="queue XML URL (default: %(default)s)")
+    parser.add_argument("-f", "--follow", action="store_true",
+                        help="keep running and print each new track")
+    parser.add_argument("-i", "--interval", type=float, default=POLL_INTERVAL,
+                        help="seconds between requests when the end of the "
+                             "track is unknown (default: %(default)s)")
+    parser.add_argument("-t", "--timeout", type=float, default=TIMEOUT,
+                        help="HTTP timeout in seconds (default: %(default)s)")
+    parser.add_argument("-s", "--section", action="append",
+                        help="print all entries of this section, e.g. queue "
+                             "or history; can be repeated")
+    parser.add_argument("--benchmark", type=int, metavar="N",
+                        help="compare parsers on a queue of N entries")
+    history_group = parser.add_argument_group("play history")
+    history_group.add_argument("-d", "--db", default=get_history_path(),
+                               help="SQLite history (default: %(default)s)")
+    history_group.add_argument("-r", "--record", action="store_true",
+                               help="add the recent plays to the history, "
+                                    "and each new one with --follow")
+    query_group = history_group.add_mutually_exclusive_group()
+    query_group.add_argument("--top-requesters", action="store_true",
+                             help="show who requested the most plays")
+    query_group.add_argument("--top-artists", action="store_true",
+                             help="show the most played artists")
+    query_group.add_argument("--last-played", metavar="SONG",
+                             help="show the last plays of a song, by id or "
+                                  "title")
+    query_group.add_argument("--artist", help="show the last plays of an "
+                                              "artist")
+    history_group.add_argument("--since", default="",
+                               help="only count plays from this date, e.g. "
+                                    "2024-05")
+    history_group.add_argument("-n", "--limit", type=int, default=10,
+                               help="number of results (default: "
+                                    "%(default)s)")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+    if args.top_requesters or args.top_artists or args.last_played \
+            or args.artist:
+        if not os.path.exists(args.db):
+            exit(f"No play history at {args.db}.")
+        query_history(open_history(args.db), args)
+        return
+    if args.section:
+        client = QueueClient(
+            args.url, timeout=args.timeout,
+            parse=lambda source: parse_queue(source, args.section),
+        )
+        queue = client.fetch()
+        for section in args.section:
+            for entry in (queue or {}).get(section, []):
+                print(f"{section}: {format_entry(entry)}")
         return
-    now_playing = get_now_playing(queue_xml)
 
-    print(
+    db = None
+    if args.record:
+        db = open_history(args.db)
+        client = QueueClient(
+            args.url, timeout=args.timeout,
+            parse=lambda source: parse_queue(source, ("now", "history")),
+        )
+        queue = client.fetch() or {}
+        added = record_plays(
+            db, queue.get("history", [])[::-1] + queue.get("now", [])
+        )
+        if not args.follow:
+            print(f"Recorded {added} new plays.")
+            return
+
+    client = QueueClient(args.url, timeout=args.timeout)
+    if args.follow:
+        try:
+            follow(client, args.interval, db)
+        except KeyboardInterrupt:
+            pass
+        return
+    now_playing = client.fetch()
+    if now_playing is None:
+        return
+    print(format_entry(now_playing))
+
+
+def format_entry(now_playing):
+    return (
         "{artists} — {song} [{length}] — requested by {req}".format(
             artists=(
                 " & ".join(
@@ -112,5 +403,145 @@ def main():
     )
 
 
+def get_history_path():
+    data_home = (os.environ.get("XDG_DATA_HOME")
+                 or os.path.expanduser("~/.local/share"))
+    return os.path.join(data_home, "nectarine-history.db")
+
+
+def open_history(path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    db = sqlite3.connect(path)
+    db.executescript(HISTORY_SCHEMA)
+    return db
+
+
+def record_plays(db, entries):
+    """Add entries to the play history and return how many were new."""
+    added = 0
+    with db:
+        for entry in entries:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO plays (playstart, request_time, "
+                "song_id, title, length, requester, requester_flag) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry.playstart, entry.request_time, entry.song.ident,
+                 entry.song.title, entry.song.length, entry.requester.name,
+                 entry.requester.flag),
+            )
+            if not cursor.rowcount:
+                continue
+            added += 1
+            db.executemany(
+                "INSERT INTO play_artists (play_id, playstart, artist_id, "
+                "name, flag) VALUES (?, ?, ?, ?, ?)",
+                [(cursor.lastrowid, entry.playstart, artist.ident,
+                  artist.name, artist.flag)
+                 for artist in entry.artists],
+            )
+    return added
+
+
+PLAY_ARTISTS = (
+    "(SELECT group_concat(name, ' & ') FROM play_artists "
+    "WHERE play_id = plays.id)"
+)
+
+
+def query_history(db, args):
+    """Print the result of the history query selected in args."""
+    if args.top_requesters:
+        rows = db.execute(
+            "SELECT count(*) AS plays, requester FROM plays "
+            "WHERE playstart >= ? GROUP BY requester "
+            "ORDER BY plays DESC LIMIT ?",
+            (args.since, args.limit),
+        )
+    elif args.top_artists:
+        # The unary plus makes SQLite use the date index instead of scanning
+        # all plays in artist order.
+        rows = db.execute(
+            "SELECT count(*) AS plays, name FROM play_artists "
+            "WHERE playstart >= ? GROUP BY +artist_id "
+            "ORDER BY plays DESC LIMIT ?",
+            (args.since, args.limit),
+        )
+    elif args.last_played:
+        if args.last_played.isdigit():
+            condition = "song_id = ?"
+        else:
+            condition = "title = ? COLLATE NOCASE"
+        rows = db.execute(
+            f"SELECT playstart, {PLAY_ARTISTS}, title, requester FROM plays "
+            f"WHERE {condition} ORDER BY playstart DESC LIMIT ?",
+            (args.last_played, args.limit),
+        )
+    else:
+        rows = db.execute(
+            f"SELECT playstart, {PLAY_ARTISTS}, title, requester FROM plays "
+            f"WHERE id IN (SELECT play_id FROM play_artists "
+            f"WHERE name = ? COLLATE NOCASE) ORDER BY playstart DESC LIMIT ?",
+            (args.artist, args.limit),
+        )
+    for row in rows:
+        print("\t".join(str(value) for value in row))
+
+
+def make_queue_xml(num_entries):
+    """Return a synthetic queue XML document with num_entries in history."""
+    def entry(i):
+        return (
+            f'<entry request_time="2024-01-01 00:00:00">'
+            f'<artist id="{i % 1000}" flag="fi">Artist {i % 1000}</artist>'
+            f'<artist id="{i % 77}" flag="se">Artist {i % 77}</artist>'
+            f'<song id="{i}" length="3:{i % 60:02}">Song {i}</song>'
+            f'<requester flag="fr">user{i % 300}</requester>'
+            f'<playstart>2024-01-01 00:00:00</playstart>'
+            f'</entry>'
+        )
+    parts = ['<?xml version="1.0" encoding="UTF-8"?><playlist>']
+    parts += ["<now>", entry(0), "</now><queue>"]
+    parts += [entry(i) for i in range(1, 21)]
+    parts.append("</queue><history>")
+    parts += [entry(i) for i in range(21, num_entries)]
+    parts.append("</history></playlist>")
+    return "".join(parts).encode()
+
+
+def benchmark(num_entries):
+    import tracemalloc
+
+    data = make_queue_xml(num_entries)
+    print(f"{len(data)} bytes, {num_entries} entries")
+
+    def tree_now():
+        return get_now_playing(ElementTree.XML(data.decode()))
+
+    def tree_all():
+        queue_xml = ElementTree.XML(data.decode())
+        return [parse_entry(node) for node in queue_xml.iter("entry")]
+
+    def stream_now():
+        return parse_now_playing(io.BytesIO(data))
+
+    def stream_all():
+        return parse_queue(io.BytesIO(data))
+
+    for label, function in (
+        ("tree, now playing", tree_now),
+        ("iterparse, now playing", stream_now),
+        ("tree, all entries", tree_all),
+        ("iterparse, all entries", stream_all),
+    ):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"{label}: {elapsed:.3f}s, peak {peak / 2**20:.1f} MiB")
+
+
 if __name__ == "__main__":
     main()
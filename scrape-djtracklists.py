@@ -1,15 +1,70 @@
 #!/usr/bin/env python3
-"""Download tracklists from djtracklists.com as CSV."""
+"""Download tracklists from djtracklists.com as CSV.
+
+Series are crawled with a thread pool sharing one pooled HTTP session. All
+requests go through a token bucket, so the crawl runs at the --rate given
+(one request per second by default) whatever the server latency. The next
+series page is fetched before the tracklists of the current one, so there are
+always tracklists waiting to be downloaded.
+
+Responses are cached in a SQLite database (see --cache) and revalidated with
+their ETag and Last-Modified headers; the least recently used ones are
+evicted when the cache grows over --cache-size. A tracklist whose page did
+not change, either because the server answered 304 or because the page has
+the same SHA-256 digest, is not parsed nor written again if its CSV exists.
+The same database holds a journal of the series being downloaded: the pages
+seen and the tracklists saved. If a download is interrupted, running it again
+goes through the journaled pages without requests and skips saved tracklists.
+The journal of a series is cleared once it is completely downloaded.
+
+Pages are parsed with lxml if it is installed, else with html.parser, and only
+the links or track rows needed are kept in the tree, using a SoupStrainer.
+Fields of a track row are then extracted in a single pass over its tags.
+"--benchmark" compares it to the previous full tree parser on tracklist pages
+given as HTML files, or on generated ones, and checks results are identical.
+
+With --db, tracklists are saved in a single SQLite database instead of CSV
+files, one row per track with the URL of its mix. Artists and remix artists
+are also stored one per row, indexed by name like titles, so the --artist,
+--title and --remixer options find the mixes that played them across the
+whole archive in a few milliseconds. Lookups are exact but case-insensitive.
+
+--pretty accepts several CSV files or glob patterns. Rows are written as whole
+lines through the buffered standard output, with timestamp formatting cached,
+so piping a whole archive to a pager is not slowed down by printing. With
+--merge, rows of all files are merged by timestamp and prefixed with their
+mix name. "--pretty-benchmark N" times it on N generated CSV files.
+"""
 
 import argparse
 import csv
+import functools
+import glob
+import hashlib
+import heapq
+import importlib.util
+import json
+import os
+import sqlite3
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Optional
+from urllib.parse import urljoin
 
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from requests.adapters import HTTPAdapter
+
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+TIMEOUT = 10
+CACHE_SIZE = 200  # MiB
+# Held to print whole lines from crawler threads.
+PRINT_LOCK = threading.Lock()
 
 
 @dataclass
@@ -34,54 +89,559 @@ def main():
                         help="download this series (provide URL of 1st page)")
     parser.add_argument("-t", "--tracklist",
                         help="download this tracklist (provide URL)")
-    parser.add_argument("--pretty", help="pretty print a CSV file.")
+    parser.add_argument("--pretty", nargs="+", metavar="CSV",
+                        help="pretty print CSV files or glob patterns")
+    parser.add_argument("-m", "--merge", action="store_true",
+                        help="with --pretty, merge rows by timestamp")
+    parser.add_argument("--pretty-benchmark", type=int, metavar="N",
+                        help="time pretty printing N generated CSV files")
+    parser.add_argument("-r", "--rate", type=positive_float, default=1.0,
+                        help="maximum requests per second (default: 1)")
+    parser.add_argument("-j", "--jobs", type=positive_int, default=4,
+                        help="number of concurrent requests (default: 4)")
+    parser.add_argument("-c", "--cache", default=get_cache_path(),
+                        help="HTTP cache and journal (default: %(default)s)")
+    parser.add_argument("--cache-size", type=int, default=CACHE_SIZE,
+                        help=f"maximum cache size in MiB (default: "
+                             f"{CACHE_SIZE})")
+    parser.add_argument("-C", "--no-cache", action="store_true",
+                        help="do not use the cache nor the journal")
+    parser.add_argument("--benchmark", nargs="*", metavar="HTML_FILE",
+                        help="compare tracklist parsers on these pages, or on "
+                             "generated ones")
+    parser.add_argument("-d", "--db",
+                        help="save tracklists in this SQLite file instead of "
+                             "CSV files, or query it")
+    query_group = parser.add_mutually_exclusive_group()
+    query_group.add_argument("--artist", help="find tracks by this artist")
+    query_group.add_argument("--title", help="find tracks with this title")
+    query_group.add_argument("--remixer",
+                             help="find tracks remixed by this artist")
     args = parser.parse_args()
 
-    if csv_file_name := args.pretty:
-        pretty_print_csv(csv_file_name)
-    elif series_url := args.series:
-        download_series(series_url)
+    if csv_file_names := args.pretty:
+        pretty_print_csv(csv_file_names, merge=args.merge)
+        return
+    if args.pretty_benchmark:
+        pretty_benchmark(args.pretty_benchmark)
+        return
+    if args.benchmark is not None:
+        benchmark(args.benchmark)
+        return
+    store = TrackStore(args.db) if args.db else None
+    if args.artist or args.title or args.remixer:
+        if not store:
+            exit("Queries require a database, see --db.")
+        if args.artist:
+            rows = store.find_by_artist(args.artist)
+        elif args.title:
+            rows = store.find_by_title(args.title)
+        else:
+            rows = store.find_by_artist(args.remixer, remix=True)
+        for row in rows:
+            print("\t".join(row))
+        return
+    cache = None
+    if not args.no_cache:
+        cache = CrawlCache(args.cache, args.cache_size * 2**20)
+    crawler = Crawler(args.rate, args.jobs, cache)
+    if series_url := args.series:
+        download_series(series_url, crawler, args.jobs, store)
     elif tracklist_url := args.tracklist:
-        download_tracklist(tracklist_url)
+        download_tracklist(tracklist_url, crawler, store=store)
 
 
-def download_series(series_url: str):
-    while series_url:
-        print("Processing series URL", series_url)
-        response = requests.get(series_url, timeout=10)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, "html.parser")
-        # Download all tracklists.
-        for tracklist_link in soup.find_all("a", class_="mix"):
-            tracklist_url = tracklist_link["href"]
-            print("Processing tracklist URL", tracklist_url)
-            download_tracklist(tracklist_url)
-            time.sleep(1)  # throttle
-        # Look for the next page button.
-        for page_link in soup.find_all("a", class_="pagenumber"):
-            if "Next" in page_link.string:
-                series_url = page_link["href"]
+def positive_float(value: str) -> float:
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def positive_int(value: str) -> int:
+    number = int(value)
+    if number <= 0:
+        raise argparse.ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
+
+def get_cache_path():
+    cache_home = (os.environ.get("XDG_CACHE_HOME")
+                  or os.path.expanduser("~/.cache"))
+    return os.path.join(cache_home, "djtracklists.db")
+
+
+class CrawlCache:
+    """HTTP response cache and series journal, in a SQLite database.
+
+    The database is shared between crawler threads, behind a lock.
+    """
+
+    def __init__(self, path: str, max_size: int = CACHE_SIZE * 2**20):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS responses (url TEXT PRIMARY KEY, "
+            "etag TEXT, last_modified TEXT, digest TEXT, body TEXT, "
+            "size INTEGER, used REAL);"
+            "CREATE INDEX IF NOT EXISTS responses_used ON responses (used);"
+            "CREATE TABLE IF NOT EXISTS journal_pages (series TEXT, "
+            "url TEXT, tracklists TEXT, next_url TEXT, "
+            "PRIMARY KEY (series, url));"
+            "CREATE TABLE IF NOT EXISTS journal_saved (series TEXT, "
+            "url TEXT, PRIMARY KEY (series, url));"
+        )
+        self.max_size = max_size
+        self.size = self.db.execute(
+            "SELECT coalesce(sum(size), 0) FROM responses"
+        ).fetchone()[0]
+        self.lock = threading.Lock()
+
+    def get_response(self, url: str):
+        """Return (etag, last_modified, digest, body) for url, or None."""
+        with self.lock:
+            return self.db.execute(
+                "SELECT etag, last_modified, digest, body FROM responses "
+                "WHERE url = ?",
+                (url,),
+            ).fetchone()
+
+    def touch_response(self, url: str):
+        with self.lock, self.db:
+            self.db.execute("UPDATE responses SET used = ? WHERE url = ?",
+                            (time.time(), url))
+
+    def put_response(self, url: str, etag, last_modified, digest: str,
+                     body: str):
+        size = len(body)
+        with self.lock, self.db:
+            old_size = self.db.execute(
+                "SELECT coalesce(sum(size), 0) FROM responses WHERE url = ?",
+                (url,),
+            ).fetchone()[0]
+            self.db.execute(
+                "INSERT OR REPLACE INTO responses "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, digest, body, size, time.time()),
+            )
+            self.size += size - old_size
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        """Remove least recently used responses to get under 90% of max."""
+        rows = self.db.execute(
+            "SELECT url, size FROM responses ORDER BY used"
+        )
+        evicted = []
+        for url, size in rows:
+            if self.size <= self.max_size * 0.9:
                 break
-        else:
-            series_url = None
+            evicted.append((url,))
+            self.size -= size
+        self.db.executemany("DELETE FROM responses WHERE url = ?", evicted)
+
+    def get_journal_page(self, series: str, url: str):
+        """Return (tracklist_urls, next_url) journaled for a page, or None."""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT tracklists, next_url FROM journal_pages "
+                "WHERE series = ? AND url = ?",
+                (series, url),
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put_journal_page(self, series: str, url: str,
+                         tracklist_urls: list[str], next_url):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO journal_pages VALUES (?, ?, ?, ?)",
+                (series, url, json.dumps(tracklist_urls), next_url),
+            )
+
+    def is_saved(self, series: str, url: str) -> bool:
+        with self.lock:
+            return self.db.execute(
+                "SELECT 1 FROM journal_saved WHERE series = ? AND url = ?",
+                (series, url),
+            ).fetchone() is not None
+
+    def mark_saved(self, series: str, url: str):
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR IGNORE INTO journal_saved VALUES (?, ?)",
+                (series, url),
+            )
+
+    def clear_journal(self, series: str):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM journal_pages WHERE series = ?",
+                            (series,))
+            self.db.execute("DELETE FROM journal_saved WHERE series = ?",
+                            (series,))
+
+
+class CrawlStopped(Exception):
+    """Raised in crawler threads when the crawl is interrupted."""
+
+
+class TokenBucket:
+    """Rate limiter allowing rate calls per second, in bursts up to burst.
+
+    Callers reserve a token under the lock, then sleep outside of it until
+    their token is available, so waiting threads are served in order. Once
+    closed, waiting and later callers get a CrawlStopped exception.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+
+    def close(self):
+        self.closed.set()
+
+    def acquire(self):
+        if self.closed.is_set():
+            raise CrawlStopped()
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.last_time) * self.rate
+            )
+            self.last_time = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0
+        if delay and self.closed.wait(delay):
+            raise CrawlStopped()
+
+
+class TrackStore:
+    """Tracks of all mixes in a SQLite database, shared between threads."""
+
+    def __init__(self, path: str):
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS mixes (id INTEGER PRIMARY KEY, "
+            "url TEXT UNIQUE NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS tracks (mix_id INTEGER NOT NULL "
+            "REFERENCES mixes (id), position INTEGER, timestamp TEXT, "
+            "artists TEXT, title TEXT, mix TEXT, remix_artists TEXT, "
+            "PRIMARY KEY (mix_id, position));"
+            "CREATE TABLE IF NOT EXISTS track_artists (mix_id INTEGER, "
+            "position INTEGER, name TEXT, remix INTEGER);"
+            "CREATE INDEX IF NOT EXISTS tracks_title "
+            "ON tracks (title COLLATE NOCASE);"
+            "CREATE INDEX IF NOT EXISTS track_artists_name "
+            "ON track_artists (name COLLATE NOCASE, remix);"
+            "CREATE INDEX IF NOT EXISTS track_artists_track "
+            "ON track_artists (mix_id, position);"
+        )
+        self.lock = threading.Lock()
+
+    def has_mix(self, url: str) -> bool:
+        with self.lock:
+            return self.db.execute(
+                "SELECT 1 FROM mixes WHERE url = ?", (url,)
+            ).fetchone() is not None
+
+    def save_mix(self, url: str, tracklist: list[Track]) -> bool:
+        """Replace the tracks stored for the mix at url.
+
+        Return True on success, False if the database can't be written.
+        """
+        try:
+            with self.lock, self.db:
+                self.db.execute("INSERT OR IGNORE INTO mixes (url) VALUES (?)",
+                                (url,))
+                mix_id = self.db.execute(
+                    "SELECT id FROM mixes WHERE url = ?", (url,)
+                ).fetchone()[0]
+                self.db.execute("DELETE FROM tracks WHERE mix_id = ?",
+                                (mix_id,))
+                self.db.execute("DELETE FROM track_artists WHERE mix_id = ?",
+                                (mix_id,))
+                self.db.executemany(
+                    "INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (mix_id, position, track.timestamp,
+                         track.format_artists(), track.title, track.mix,
+                         track.format_mix_artists())
+                        for position, track in enumerate(tracklist)
+                    ],
+                )
+                self.db.executemany(
+                    "INSERT INTO track_artists VALUES (?, ?, ?, ?)",
+                    [
+                        (mix_id, position, name, remix)
+                        for position, track in enumerate(tracklist)
+                        for remix, names in ((0, track.artists),
+                                             (1, track.mix_artists or []))
+                        for name in names
+                    ],
+                )
+        except sqlite3.Error as exc:
+            log(f"Can't save tracklist: {exc}")
+            return False
+        return True
+
+    def find_by_artist(self, name: str, remix: bool = False):
+        """Return (mix URL, timestamp, track) rows with this artist."""
+        return self.find(
+            "JOIN track_artists USING (mix_id, position) "
+            "WHERE name = ? COLLATE NOCASE AND remix = ?",
+            (name, int(remix)),
+        )
+
+    def find_by_title(self, title: str):
+        """Return (mix URL, timestamp, track) rows with this title."""
+        return self.find("WHERE title = ? COLLATE NOCASE", (title,))
+
+    def find(self, condition: str, parameters: tuple):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT DISTINCT url, COALESCE(timestamp, ''), artists, "
+                "title, mix, remix_artists, mix_id, position FROM tracks "
+                f"JOIN mixes ON mixes.id = mix_id {condition} "
+                "ORDER BY url, position",
+                parameters,
+            ).fetchall()
+        return [
+            (url, timestamp, format_track(artists, title, mix, remix_artists))
+            for url, timestamp, artists, title, mix, remix_artists, _, _
+            in rows
+        ]
+
+
+class Crawler:
+    """Rate-limited HTTP client sharing a connection pool between threads."""
+
+    def __init__(self, rate: float = 1.0, jobs: int = 4,
+                 cache: Optional[CrawlCache] = None):
+        self.bucket = TokenBucket(rate)
+        self.cache = cache
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=jobs)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def get(self, url: str) -> requests.Response:
+        self.bucket.acquire()
+        response = self.session.get(url, timeout=TIMEOUT)
+        response.raise_for_status()
+        return response
+
+    def get_page(self, url: str) -> tuple[str, bool]:
+        """Return the text of a page and whether it changed since cached."""
+        if not self.cache:
+            return self.get(url).text, True
+        cached = self.cache.get_response(url)
+        headers = {}
+        if cached:
+            etag, last_modified, digest, body = cached
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        self.bucket.acquire()
+        response = self.session.get(url, headers=headers, timeout=TIMEOUT)
+        if cached and response.status_code == 304:
+            self.cache.touch_response(url)
+            return body, False
+        response.raise_for_status()
+        new_digest = hashlib.sha256(response.content).hexdigest()
+        self.cache.put_response(
+            url, response.headers.get("ETag"),
+            response.headers.get("Last-Modified"), new_digest, response.text
+        )
+        return response.text, not cached or new_digest != digest
+
+
+def download_series(series_url: str, crawler: Optional[Crawler] = None,
+                    jobs: int = 4, store: Optional[TrackStore] = None):
+    crawler = crawler or Crawler(jobs=jobs)
+    series = series_url
+    executor = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        page_future = executor.submit(get_series_page, series_url, crawler,
+                                      series)
+        tracklist_futures = []
+        while page_future:
+            tracklist_urls, series_url = page_future.result()
+            # Prefetch the next page before queueing this page's tracklists.
+            page_future = None
+            if series_url:
+                page_future = executor.submit(
+                    get_series_page, series_url, crawler, series
+                )
+            tracklist_futures += [
+                executor.submit(download_tracklist, tracklist_url, crawler,
+                                series, store)
+                for tracklist_url in tracklist_urls
+            ]
+        saved = [future.result() for future in tracklist_futures]
+    except BaseException:
+        # Drop queued downloads and wake up threads waiting for a token, so
+        # an interruption stops the crawl after the requests in progress.
+        executor.shutdown(wait=False, cancel_futures=True)
+        crawler.bucket.close()
+        raise
+    executor.shutdown()
+    if crawler.cache and all(saved):
+        crawler.cache.clear_journal(series)
+
 
+def get_series_page(series_url: str, crawler: Crawler,
+                    series: Optional[str] = None):
+    """Return the tracklist URLs of a series page and the next page URL."""
+    cache = crawler.cache if series else None
+    if cache and (journaled := cache.get_journal_page(series, series_url)):
+        return journaled
+    log(f"Processing series URL {series_url}")
+    text, _ = crawler.get_page(series_url)
+    soup = BeautifulSoup(
+        text, HTML_PARSER,
+        parse_only=SoupStrainer("a", class_=("mix", "pagenumber")),
+    )
+    tracklist_urls = [
+        urljoin(series_url, tracklist_link["href"])
+        for tracklist_link in soup.find_all("a", class_="mix")
+    ]
+    next_url = None
+    # Look for the next page button.
+    for page_link in soup.find_all("a", class_="pagenumber"):
+        if "Next" in page_link.string:
+            next_url = urljoin(series_url, page_link["href"])
+            break
+    if cache:
+        cache.put_journal_page(series, series_url, tracklist_urls, next_url)
+    return tracklist_urls, next_url
 
-def download_tracklist(url: str):
-    tracklist = get_tracklist_from_url(url)
+
+def download_tracklist(url: str, crawler: Optional[Crawler] = None,
+                       series: Optional[str] = None,
+                       store: Optional[TrackStore] = None) -> bool:
+    """Save a tracklist in store, or as CSV in the current directory.
+
+    Return True if it is saved or unchanged, False on error. If series is set
+    and the crawler has a cache, skip tracklists already saved for it.
+    """
+    cache = crawler.cache if crawler and series else None
+    if cache and cache.is_saved(series, url):
+        return True
+    log(f"Processing tracklist URL {url}")
+    crawler = crawler or Crawler()
     name = url.rstrip("/").rsplit("/", maxsplit=1)[-1]
     file_name = Path.cwd() / (name + ".csv")
-    save_tracklist_as_csv(tracklist, file_name)
+    try:
+        text, changed = crawler.get_page(url)
+    except requests.RequestException as exc:
+        log(f"Can't download tracklist: {exc}")
+        return False
+    if store:
+        if changed or not store.has_mix(url):
+            if not store.save_mix(url, parse_tracklist(text)):
+                return False
+    elif changed or not file_name.exists():
+        if not save_tracklist_as_csv(parse_tracklist(text), file_name):
+            return False
+    if cache:
+        cache.mark_saved(series, url)
+    return True
+
+
+def log(message: str):
+    with PRINT_LOCK:
+        print(message, flush=True)
 
 
 def is_track_row(css_class: str) -> bool:
     return css_class in ("on", "off")
 
 
-def get_tracklist_from_url(url: str) -> list[Track]:
+def get_tracklist_from_url(url: str,
+                           crawler: Optional[Crawler] = None) -> list[Track]:
     """Get tracklist from the Web and parse it into a list of Track objects."""
-    response = requests.get(url, timeout=10)
-    response.raise_for_status()
-    soup = BeautifulSoup(response.text, "html.parser")
+    if crawler:
+        response = crawler.get(url)
+    else:
+        response = requests.get(url, timeout=TIMEOUT)
+        response.raise_for_status()
+    return parse_tracklist(response.text)
+
+
+def parse_tracklist(html: str) -> list[Track]:
+    """Parse a tracklist page into a list of Track objects.
+
+    Only track rows are parsed, and each row is walked once. Strings are
+    copied out of the tree so it can be freed.
+    """
+    soup = BeautifulSoup(
+        html, HTML_PARSER,
+        parse_only=SoupStrainer("div", class_=is_track_row),
+    )
+    tracklist = []
+    for row in soup.find_all("div", class_=is_track_row):
+        track_link = release_link = bold = time_span = None
+        artist_links = []
+        for tag in row.find_all(True):
+            name = tag.name
+            classes = tag.get("class") or ()
+            if name == "a":
+                if "artist" in classes:
+                    artist_links.append(tag)
+                if "track" in classes and track_link is None:
+                    track_link = tag
+                if "release" in classes and release_link is None:
+                    release_link = tag
+            elif name == "b" and bold is None:
+                bold = tag
+            elif name == "span" and "index_time" in classes \
+                    and time_span is None:
+                time_span = tag
+
+        if track_link and release_link:
+            title = get_string(track_link)
+            mix = get_string(release_link)
+        else:
+            title = get_string(bold) if bold else "(unknown title)"
+            mix = None
+        if time_span:
+            timestamp = get_string(time_span)
+        else:
+            timestamp = "(unknown timestamp)"
+
+        artists = []
+        mix_artists = []
+        for artist in artist_links:
+            prev_tag = artist.previous_sibling.string
+            if getattr(prev_tag, "string", "").strip() == "remixed  by":
+                mix_artists.append(get_string(artist))
+            else:
+                artists.append(get_string(artist))
+        tracklist.append(
+            Track(
+                title=title,
+                mix=mix,
+                artists=artists,
+                mix_artists=mix_artists or None,
+                timestamp=timestamp,
+            )
+        )
+    return tracklist
+
+
+def get_string(tag) -> Optional[str]:
+    string = tag.string
+    return None if string is None else str(string)
+
+
+def parse_tracklist_full(html: str) -> list[Track]:
+    """Parse a tracklist page building the whole tree, for the benchmark."""
+    soup = BeautifulSoup(html, "html.parser")
     tracklist = []
     for row in soup.find_all("div", class_=is_track_row):
         artists = []
@@ -120,7 +680,7 @@ def get_tracklist_from_url(url: str) -> list[Track]:
     return tracklist
 
 
-def save_tracklist_as_csv(tracklist: list[Track], file_name: Path):
+def save_tracklist_as_csv(tracklist: list[Track], file_name: Path) -> bool:
     try:
         with open(file_name, "wt", encoding="utf8", newline="") as file:
             writer = csv.writer(file)
@@ -136,10 +696,87 @@ def save_tracklist_as_csv(tracklist: list[Track], file_name: Path):
                     track.format_mix_artists(),
                 ])
     except OSError as exc:
-        print(f"Can't save tracklist: {exc}")
+        log(f"Can't save tracklist: {exc}")
+        return False
+    return True
+
+
+def pretty_print_csv(csv_file_names: list[str], merge: bool = False,
+                     out=None):
+    """Pretty print CSV files, one after another or merged by timestamp.
+
+    File names may be glob patterns. Lines are written to out, by default the
+    standard output, which is fine if the reader stops early, e.g. a pager.
+    """
+    out = out or sys.stdout
+    file_names = []
+    for name in csv_file_names:
+        file_names += sorted(glob.glob(name)) if glob.has_magic(name) \
+            else [name]
+    try:
+        if merge:
+            # Files are read in memory first so they are not all open at once.
+            rows = heapq.merge(
+                *(list(read_csv_rows(name)) for name in file_names),
+                key=lambda row: row[0],
+            )
+            out.writelines(
+                f"{ts}  {mix_name}  {track}\n"
+                for _, ts, mix_name, track in rows
+            )
+        else:
+            for file_name in file_names:
+                if len(file_names) > 1:
+                    out.write(f"{Path(file_name).stem}:\n")
+                out.writelines(
+                    f"{ts}  {track}\n"
+                    for _, ts, _, track in read_csv_rows(file_name)
+                )
+        out.flush()
+    except BrokenPipeError:
+        # Do not complain again when the interpreter flushes stdout.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def read_csv_rows(csv_file_name: str):
+    """Yield (seconds, timestamp, mix name, track) from a tracklist CSV.
+
+    Seconds is the sort key of the row: rows without a valid timestamp get
+    the one of the previous row, so keys of a file are always ordered.
+    """
+    mix_name = Path(csv_file_name).stem
+    seconds = 0
+    try:
+        with open(csv_file_name, "rt", encoding="utf8", newline="") as file:
+            reader = csv.reader(file)
+            next(reader, None)  # header
+            for ts, artists, title, mix, remix_artists in reader:
+                ts, row_seconds = format_timestamp(ts)
+                if row_seconds is not None:
+                    seconds = row_seconds
+                track = format_track(artists, title, mix, remix_artists)
+                yield seconds, ts, mix_name, track
+    except OSError as exc:
+        print(f"Can't read CSV: {exc}", file=sys.stderr)
+
+
+@functools.lru_cache(maxsize=4096)
+def format_timestamp(ts: str) -> tuple[str, Optional[int]]:
+    """Return a "min:sec" timestamp as "hh:mm:ss", and in seconds if valid."""
+    if ":" not in ts:
+        return ts, None
+    ts_min, ts_sec = ts.split(":")
+    ts_min = int(ts_min)
+    ts_h, ts_min = ts_min // 60, ts_min % 60
+    try:
+        seconds = (ts_h * 60 + ts_min) * 60 + int(ts_sec)
+    except ValueError:
+        seconds = None
+    return f"{ts_h:02}:{ts_min:02}:{ts_sec}", seconds
 
 
-def pretty_print_csv(csv_file_name: str):
+def pretty_print_csv_simple(csv_file_name: str):
+    """Previous pretty printer, printing pieces of lines, for the benchmark."""
     try:
         with open(csv_file_name, "rt", encoding="utf8", newline="") as file:
             reader = csv.reader(file)
@@ -164,5 +801,101 @@ def pretty_print_csv(csv_file_name: str):
         print(f"Can't read CSV: {exc}")
 
 
+def pretty_benchmark(num_files: int):
+    import contextlib
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_names = []
+        for i in range(num_files):
+            tracklist = [
+                Track(
+                    title=f"Title {i}-{j}",
+                    artists=[f"Artist {j}", f"Artist {i % 100}"],
+                    mix=f"Mix {j}" if j % 2 else None,
+                    mix_artists=[f"Remixer {j}"] if j % 4 == 1 else None,
+                    timestamp=f"{j * 3 + i % 3}:{(i + j) % 60:02}",
+                )
+                for j in range(40)
+            ]
+            file_name = Path(tmp_dir) / f"mix-{i}.csv"
+            save_tracklist_as_csv(tracklist, file_name)
+            file_names.append(str(file_name))
+        print(f"{num_files} files of 40 rows")
+        with open(os.devnull, "wt", encoding="utf8") as devnull:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(devnull):
+                for file_name in file_names:
+                    pretty_print_csv_simple(file_name)
+            simple_time = time.perf_counter() - start
+            timings = {}
+            for merge in (False, True):
+                format_timestamp.cache_clear()
+                start = time.perf_counter()
+                pretty_print_csv(file_names, merge=merge, out=devnull)
+                timings[merge] = time.perf_counter() - start
+        print(f"one print per piece: {simple_time:.3f}s")
+        print(f"buffered lines: {timings[False]:.3f}s")
+        print(f"buffered lines, merged: {timings[True]:.3f}s")
+
+
+def format_track(artists: str, title: str, mix: str,
+                 remix_artists: str) -> str:
+    line = f"{artists or '(unknown)'} — {title}"
+    if mix:
+        line += f"  ({mix})"
+        if remix_artists:
+            line += f" by {remix_artists}"
+    return line
+
+
+def make_tracklist_html(num_tracks: int) -> str:
+    """Return a generated tracklist page, with the kinds of rows parsed."""
+    rows = []
+    for i in range(num_tracks):
+        if i % 7 == 6:
+            body = f"<b>Unreleased {i}</b>"
+        else:
+            body = (
+                f'<a class="artist" href="/artist/{i}">Artist {i}</a> - '
+                f'<a class="track" href="/track/{i}">Title {i}</a> '
+                f'<a class="release" href="/release/{i}">Mix {i}</a>'
+            )
+            if i % 3 == 0:
+                body += (
+                    f' <span>remixed  by</span>'
+                    f'<a class="artist" href="/artist/r{i}">Remixer {i}</a>'
+                )
+        rows.append(
+            f'<div class="{"on" if i % 2 else "off"}">'
+            f'<span class="index_time">{i * 4}:{i % 60:02}</span> {body}'
+            f'<div class="votes"><img src="/up.png"> 12</div></div>'
+        )
+    navigation = "".join(
+        f'<li><a href="/page/{i}">Page {i}</a></li>' for i in range(200)
+    )
+    return (
+        f"<html><head><title>Mix</title></head><body>"
+        f"<ul>{navigation}</ul><div id='tracklist'>{''.join(rows)}</div>"
+        f"<ul>{navigation}</ul></body></html>"
+    )
+
+
+def benchmark(html_file_names: list[str]):
+    if html_file_names:
+        pages = [Path(name).read_text(encoding="utf8")
+                 for name in html_file_names]
+    else:
+        pages = [make_tracklist_html(20 + i % 40) for i in range(200)]
+    print(f"{len(pages)} pages, parser {HTML_PARSER}")
+    results = {}
+    for label, function in (("full tree", parse_tracklist_full),
+                            ("track rows", parse_tracklist)):
+        start = time.perf_counter()
+        results[label] = [function(page) for page in pages]
+        print(f"{label}: {time.perf_counter() - start:.3f}s")
+    print("identical:", results["full tree"] == results["track rows"])
+
+
 if __name__ == "__main__":
     main()
@@ -9,13 +9,24 @@ https://docs.google.com/spreadsheets/d/1t-pjAgZDyKPXcCRnEdATFQOxGbQFMjZm-8EvXiQd
 
 If colorama is installed on your system (it often is for some reason), the
 output will be colored; else it will still properly display text.
+
+The CSV is compiled into a marshalled index in the cache directory, rebuilt
+when the CSV modification time or size changes, so a lookup is a dict access
+instead of a scan of the whole table. Modules needed only to build the index
+or parse options are imported on demand, so calling the script for each
+keystroke, e.g. from shell completion or an editor, stays cheap.
 """
 
-import argparse
-import csv
-from pathlib import Path
+import marshal
+import os
+import sys
 
-CSV = Path.home() / ".local/share/toki/nimi-ale-pona.csv"
+CSV = os.path.expanduser("~/.local/share/toki/nimi-ale-pona.csv")
+INDEX = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "toki-index.marshal",
+)
+INDEX_VERSION = 1
 
 try:
     from colorama import Fore, init, Style
@@ -29,23 +40,68 @@ else:
     init()
 
 def main():
+    word = parse_args()
+    fields, rows, words = load_index()
+    if word:
+        if (row_index := words.get(word)) is not None:
+            print_row(dict(zip(fields, rows[row_index])))
+        else:
+            print("nimi ala!")
+    else:
+        for row in rows:
+            print_row(dict(zip(fields, row)))
+
+def parse_args():
+    """Return the word to search, or None; argparse is only loaded if needed."""
+    argv = sys.argv[1:]
+    if len(argv) == 1 and not argv[0].startswith("-"):
+        return argv[0]
+    import argparse
     argparser = argparse.ArgumentParser(description="nimi ale pona!")
     argparser.add_argument("word", nargs="?", help="word to search")
-    args = argparser.parse_args()
+    return argparser.parse_args().word
 
-    with open(CSV) as nap_file:
+def load_index(csv_path=CSV, index_path=INDEX):
+    """Return fields, rows and a dict of words to row indexes.
+
+    They are loaded from the index if it matches the CSV, else the index is
+    rebuilt from the CSV and saved.
+    """
+    stat = os.stat(csv_path)
+    key = [INDEX_VERSION, os.path.abspath(csv_path), stat.st_mtime_ns,
+           stat.st_size]
+    try:
+        with open(index_path, "rb") as index_file:
+            # marshal.load reads file objects in small chunks, loads is
+            # an order of magnitude faster.
+            index = marshal.loads(index_file.read())
+        if index[0] == key:
+            return index[1:]
+    except (OSError, EOFError, ValueError, TypeError, IndexError):
+        pass
+    fields, rows, words = build_index(csv_path)
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        tmp_path = f"{index_path}.{os.getpid()}"
+        with open(tmp_path, "wb") as index_file:
+            index_file.write(marshal.dumps([key, fields, rows, words]))
+        os.replace(tmp_path, index_path)
+    except OSError:
+        pass
+    return fields, rows, words
+
+def build_index(csv_path):
+    import csv
+    with open(csv_path) as nap_file:
         nap_csv = csv.DictReader(nap_file)
-        if args.word:
-            for row in nap_csv:
-                words = row["word"].split(", ")
-                if args.word in words:
-                    print_row(row)
-                    break
-            else:
-                print("nimi ala!")
-        else:
-            for row in nap_csv:
-                print_row(row)
+        fields = nap_csv.fieldnames
+        rows = [[row.get(field) for field in fields] for row in nap_csv]
+    words = {}
+    word_field = fields.index("word")
+    for row_index, row in enumerate(rows):
+        for word in row[word_field].split(", "):
+            words.setdefault(word, row_index)
+    return fields, rows, words
 
 COLORED_CATS = {  # soweli suwi kule!
     "pu": f"{Fore.GREEN}pu{Fore.RESET}",